@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+"""
+Per-minute log volume by source and by level.
+
+One cheap pass over the tokenized stream of a logFile counts the lines of every minute for each source (subsystem,
+with instance ids stripped) and each level.  Counts are kept in array('L') rows indexed by minute, so a day long log
+costs a few kilobytes per source.  The dashboard draws the rows as heatmaps, which show which subsystems flood the
+log, and hotWindows() points at the busiest stretches so the expensive analyzers can be run on just that window.
+"""
+import argparse
+from array import array
+from datetime import datetime, timedelta
+from LogFile import logFile, LogTranslator
+from scan_log import PatternIndex
+from Instrumentation import stage
+
+MINUTE_FORMAT = '%Y-%m-%d %H:%M'
+MIN_YEAR = 2000             # Earlier timestamps come from a router whose clock wasn't set yet, unless relative
+MAX_MINUTES = 90 * 24 * 60  # Longest span kept.  Lines outside it are counted as skipped.
+MAX_ROWS = 20               # Heatmap rows, the quietest sources are summed into 'other'
+HOT_WINDOW_MINUTES = 30
+
+
+class ActivityHistogram(object):
+    def __init__(self, minYear=MIN_YEAR):
+        self.minYear = minYear  # None counts every year, for logs with relative timestamps
+        self.start = None       # datetime of the first minute, set by finish()
+        self.total = array('L')
+        self.sources = {}       # Normalized source -> per-minute line counts
+        self.levels = {}        # Normalized level -> per-minute line counts
+        self.lines = 0
+        self.skipped = 0        # Lines without a usable timestamp
+
+        # Rows grow in both directions while counting.  Slot self._offset is the minute of self._origin.
+        self._origin = None
+        self._offset = 0
+        self._first = None
+        self._last = None
+        self._lastMinute = None
+        self._lastSlot = None
+        self._sourceNames = {}
+        self._levelNames = {}
+
+    @classmethod
+    def fromLog(cls, log):
+        """Count every line of an open logFile.  The log is reset afterwards, so analyzers can reuse it."""
+        hist = cls(None if log.relativeTime else MIN_YEAR)
+        with stage('activity') as st:
+            log.reset()
+            log.setIterMode('tokenize')
+            for tokens in log:
+                hist.add(tokens['timestamp'], tokens['level'], tokens['source'])
+            log.reset()
+            st.lines = hist.lines + hist.skipped
+        hist.finish()
+        return hist
+
+    def _rows(self):
+        yield self.total
+        yield from self.sources.values()
+        yield from self.levels.values()
+
+    def _newRow(self):
+        return array('L', [0]) * len(self.total)
+
+    def _slot(self, timestamp):
+        """Row index of the minute of a common format timestamp, or None if it can't be counted"""
+        minute = timestamp[:16]
+        if minute == self._lastMinute:
+            return self._lastSlot
+
+        try:
+            when = datetime.strptime(minute, MINUTE_FORMAT)
+        except ValueError:
+            return None
+        if self.minYear is not None and when.year < self.minYear:
+            return None
+        if self._origin is None:
+            self._origin = when
+
+        slot = int((when - self._origin).total_seconds()) // 60 + self._offset
+        first = slot if self._first is None else min(self._first, slot)
+        last = slot if self._last is None else max(self._last, slot)
+        if last - first >= MAX_MINUTES:
+            return None
+
+        if slot < 0:
+            # Grow by at least the current size, so a newest-first log isn't copied again for every minute
+            grow = max(-slot, len(self.total))
+            for row in self._rows():
+                row[0:0] = array('L', [0]) * grow
+            self._offset += grow
+            slot += grow
+            first += grow
+            last += grow
+        elif slot >= len(self.total):
+            grow = max(slot + 1 - len(self.total), len(self.total))
+            for row in self._rows():
+                row.extend(array('L', [0]) * grow)
+
+        self._first, self._last = first, last
+        self._lastMinute, self._lastSlot = minute, slot
+        return slot
+
+    def add(self, timestamp, level, source):
+        """Count one line"""
+        slot = self._slot(timestamp)
+        if slot is None:
+            self.skipped += 1
+            return
+        self.lines += 1
+        self.total[slot] += 1
+
+        name = self._sourceNames.get(source)
+        if name is None:
+            name = self._sourceNames[source] = PatternIndex.normalize_source(source) or 'unknown'
+        row = self.sources.get(name)
+        if row is None:
+            row = self.sources[name] = self._newRow()
+        row[slot] += 1
+
+        name = self._levelNames.get(level)
+        if name is None:
+            name = self._levelNames[level] = PatternIndex.normalize_level(level) or 'unknown'
+        row = self.levels.get(name)
+        if row is None:
+            row = self.levels[name] = self._newRow()
+        row[slot] += 1
+
+    def finish(self):
+        """Trim the rows to the minutes actually seen.  Called by fromLog() once counting is done."""
+        if self._first is None:
+            self.total = array('L')
+            self.sources = {}
+            self.levels = {}
+            return
+
+        first, last = self._first, self._last
+        self.start = self._origin + timedelta(minutes=first - self._offset)
+        self.total = self.total[first:last + 1]
+        for table in (self.sources, self.levels):
+            for name in table:
+                table[name] = table[name][first:last + 1]
+        self._origin, self._offset, self._first, self._last = self.start, 0, 0, last - first
+        self._lastMinute = None
+
+    @property
+    def minutes(self):
+        return len(self.total)
+
+    def topRows(self, table, maxRows=MAX_ROWS):
+        """[(name, counts)] of a table (self.sources or self.levels), busiest first.  Rows past maxRows are summed
+           into a single 'other' row."""
+        rows = sorted(table.items(), key=lambda item: sum(item[1]), reverse=True)
+        if len(rows) <= maxRows:
+            return rows
+
+        other = self._newRow()
+        for name, counts in rows[maxRows - 1:]:
+            for slot, count in enumerate(counts):
+                other[slot] += count
+        return rows[:maxRows - 1] + [('other', other)]
+
+    def hotWindows(self, minutes=HOT_WINDOW_MINUTES, count=3):
+        """The busiest non-overlapping windows of the log as [(start, end, lines)], busiest first"""
+        if not self.minutes:
+            return []
+        minutes = min(minutes, self.minutes)
+
+        # Lines in the window starting at each minute, from running sums
+        sums = [0]
+        for lines in self.total:
+            sums.append(sums[-1] + lines)
+        windowLines = [sums[slot + minutes] - sums[slot] for slot in range(self.minutes - minutes + 1)]
+
+        windows = []
+        for slot in sorted(range(len(windowLines)), key=lambda slot: windowLines[slot], reverse=True):
+            if len(windows) >= count or not windowLines[slot]:
+                break
+            if any(abs(slot - taken) < minutes for taken, lines in windows):
+                continue
+            windows.append((slot, windowLines[slot]))
+
+        return [(self.start + timedelta(minutes=slot), self.start + timedelta(minutes=slot + minutes), lines)
+                for slot, lines in windows]
+
+    def getPlots(self, maxRows=MAX_ROWS):
+        """Heatmaps of lines per minute by source and by level.  Returns [] if no line had a usable timestamp."""
+        if not self.minutes:
+            return []
+
+        # Bokeh is only imported once a plot is requested, counting doesn't need it
+        from bokeh.plotting import figure
+        from bokeh.models import ColumnDataSource, LogColorMapper, Range1d
+        from bokeh.palettes import Viridis256
+
+        end = self.start + timedelta(minutes=self.minutes)
+        plots = []
+        for title, label, table in (('Log Volume by Source', 'Source', self.sources),
+                                    ('Log Volume by Level', 'Level', self.levels)):
+            rows = self.topRows(table, maxRows)
+            x, y, counts, timeStr = [], [], [], []
+            for name, row in rows:
+                for slot, lines in enumerate(row):
+                    if lines:
+                        minute = self.start + timedelta(minutes=slot)
+                        x.append(minute + timedelta(seconds=30))
+                        y.append(name)
+                        counts.append(lines)
+                        timeStr.append(minute.strftime(MINUTE_FORMAT))
+
+            p = figure(plot_width=1000, plot_height=80 + 22 * len(rows), x_axis_type='datetime',
+                       x_range=Range1d(self.start, end), y_range=[name for name, row in reversed(rows)],
+                       tooltips=[(label, "@y"), ("Minute", "@timeStr"), ("Lines", "@count")])
+            p.title.text = title
+            mapper = LogColorMapper(palette=Viridis256, low=1, high=max(counts))
+            source = ColumnDataSource(data=dict(x=x, y=y, count=counts, timeStr=timeStr))
+            p.rect('x', 'y', width=60 * 1000, height=0.9, source=source, line_color=None,
+                   fill_color={'field': 'count', 'transform': mapper})
+            p.grid.grid_line_color = None
+            plots.append(p)
+        return plots
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Lines per minute by source and level, and the busiest windows')
+    parser.add_argument('filename', type=str, help='log file to count')
+    parser.add_argument('--window', type=int, default=HOT_WINDOW_MINUTES, help='hot window length in minutes')
+    parser.add_argument('--plot', action='store_true', help='show the heatmaps')
+
+    args = parser.parse_args()
+    log = logFile(args.filename)
+    log.open()
+    hist = ActivityHistogram.fromLog(log)
+    log.close()
+
+    print('{} lines over {} minutes from {} ({} without a usable timestamp)'.format(
+        hist.lines, hist.minutes, hist.start, hist.skipped))
+    for name, row in hist.topRows(hist.sources, 10):
+        print('{:<30}{:>10}  peak {}/min'.format(name, sum(row), max(row)))
+    for start, end, lines in hist.hotWindows(args.window):
+        print('Hot window {} - {}: {} lines'.format(start.strftime(LogTranslator.OUTPUT_DATE_FORMAT),
+                                                    end.strftime(LogTranslator.OUTPUT_DATE_FORMAT), lines))
+    if args.plot:
+        from bokeh.plotting import output_file, show
+        from bokeh.layouts import column
+        output_file('activity.html')
+        show(column(*hist.getPlots()))
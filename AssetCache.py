@@ -0,0 +1,75 @@
+"""
+Cached, compressed, conditional responses for files the app serves over and over.
+
+PrecompressedFile keeps a file's bytes and a gzipped copy in memory, along with an ETag and Last-Modified time.  A
+request is answered from memory, with a 304 when the client's copy is current.  The file is re-stat'ed on every
+request and reloaded only when its mtime or size changes.
+
+bokehAssets() lists the BokehJS bundle files shipped inside the installed bokeh package.  The app serves them from
+a versioned URL, so browsers can cache them forever instead of fetching them again for every dashboard.
+"""
+import gzip
+import hashlib
+import os
+import threading
+from datetime import datetime, timezone
+from functools import lru_cache
+from flask import Response
+
+
+class PrecompressedFile(object):
+    def __init__(self, path, mimetype, compressLevel=9):
+        self.path = path
+        self.mimetype = mimetype
+        self.compressLevel = compressLevel
+        self._lock = threading.Lock()
+        # (stamp, raw bytes, gzipped bytes, etag, last modified), replaced as a whole so a response never mixes
+        # the body of one version of the file with the headers of another
+        self._snapshot = None
+
+    def _refresh(self):
+        """Reload the file if it changed on disk since it was last read.  Returns the current snapshot."""
+        st = os.stat(self.path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot[0] == stamp:
+            return snapshot
+
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None and snapshot[0] == stamp:  # Another thread already reloaded it
+                return snapshot
+            with open(self.path, 'rb') as f:
+                raw = f.read()
+            snapshot = (stamp, raw, gzip.compress(raw, self.compressLevel), hashlib.sha1(raw).hexdigest(),
+                        datetime.fromtimestamp(int(st.st_mtime), tz=timezone.utc))
+            self._snapshot = snapshot
+            return snapshot
+
+    def response(self, request):
+        """Build the response for request: gzipped if the client accepts it, 304 if its cached copy is current"""
+        stamp, raw, gzipped, etag, lastModified = self._refresh()
+
+        useGzip = 'gzip' in request.headers.get('Accept-Encoding', '').lower()
+        resp = Response(gzipped if useGzip else raw, mimetype=self.mimetype)
+        if useGzip:
+            resp.headers['Content-Encoding'] = 'gzip'
+        resp.headers['Vary'] = 'Accept-Encoding'
+        resp.set_etag(etag + ('-gz' if useGzip else ''))
+        resp.last_modified = lastModified
+        resp.cache_control.no_cache = True  # Always revalidate, which is a cheap 304 while the file is unchanged
+        return resp.make_conditional(request)
+
+
+@lru_cache(maxsize=1)
+def bokehAssets():
+    """(bokeh version, static dir, [js files], [css files]) for the core BokehJS bundle of the installed bokeh.
+       Paths are relative to the static dir.  Bokeh is only imported the first time this is called."""
+    import bokeh
+    from bokeh.util import paths
+    staticDir = paths.bokehjsdir() if hasattr(paths, 'bokehjsdir') else str(paths.bokehjs_path())
+
+    # bokeh 1.x ships a separate stylesheet, 2.x and later bundle the styles into the JS
+    jsFiles = [name for name in ['js/bokeh.min.js'] if os.path.exists(os.path.join(staticDir, name))]
+    cssFiles = [name for name in ['css/bokeh.min.css'] if os.path.exists(os.path.join(staticDir, name))]
+    return bokeh.__version__, staticDir, jsFiles, cssFiles
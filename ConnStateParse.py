@@ -1,13 +1,14 @@
 #!/usr/bin/env python
 import argparse
+import json
 import re
+import sys
 from enum import Enum, auto
 from pprint import pprint
 from copy import copy
-from datetime import datetime
-from bokeh.plotting import figure, output_file, show
-from bokeh.models import ColumnDataSource, HoverTool
-from LogFile import logFile
+from datetime import datetime, timedelta
+from LogFile import logFile, mergedLogFile
+from Instrumentation import stage
 
 class ConnStateParse():
     #Wan state enumeration
@@ -49,6 +50,11 @@ class ConnStateParse():
 
         def getCSV(self):
             return '{},{},{},"{}"\n'.format(self.dt, self.uid, self.state, self.details)
+
+        def getJSON(self):
+            # One JSON Lines record
+            return json.dumps({'datetime': self.dtstr, 'uid': self.uid, 'state': self.state,
+                               'details': self.details}) + '\n'
         
         def getList(self):
             return [self.dt, self.state, self.detailFormat(), self.dtstr]
@@ -111,45 +117,75 @@ class ConnStateParse():
             retEvt = self.WanEvent(time,uid,state)
         return retEvt
 
-    #Main parsing funcion
-    #Given file name parse it and return the specified format
-    #Output is {uid:[[time,state,details],],}
-    #output optional CSV string of all data
+    #Generator over the WanEvents in a log, in log order
     @classmethod
-    def parseLog(self, log, retType):
-        retTypes = ['dict', 'csv', 'plot']
-        if retType not in retTypes:
-            raise ValueError(' retType must be in {}'.format(retTypes))
+    def iterEvents(self, log):
         #Every function in list below will be executed on every line
         parseFuncs = [self._parseDevState, self._parseUnplug, self._parsePlug] # Every function here should parse a line and return a wanEvt
         log.reset()
-        retCSV = self.WanEvent.getCSVHeader()  # Start building string of all parsed data in CSV output format
-        retDict = {}
         for line in log:
             for func in parseFuncs:
                 evt = func(line)
                 if evt:  # If evt not None, we've got a new event to add
-                    if retType == 'csv':  # Building CSV output
-                        retCSV += evt.getCSV()
-                    if retType in ['dict', 'plot']:  # Here we're building dictionary output
-                        if not evt.uid in retDict:
-                            retDict[evt.uid] = []
-                        retDict[evt.uid].append(evt.getList())
+                    yield evt
                     break
         log.reset()
+
+    #Streaming export: yields the output one event at a time so memory use doesn't grow with the log
+    #exportTypes: 'csv' (with header row) or 'jsonl' (JSON Lines)
+    @classmethod
+    def iterExport(self, log, exportType='csv'):
+        exportTypes = ['csv', 'jsonl']
+        if exportType not in exportTypes:
+            raise ValueError(' exportType must be in {}'.format(exportTypes))
+        if exportType == 'csv':
+            yield self.WanEvent.getCSVHeader()
+        for evt in self.iterEvents(log):
+            yield evt.getCSV() if exportType == 'csv' else evt.getJSON()
+
+    #Write the streaming export to any object with a write() method (file, socket, response stream)
+    @classmethod
+    def exportLog(self, log, outFile, exportType='csv'):
+        for chunk in self.iterExport(log, exportType):
+            outFile.write(chunk)
+
+    #Main parsing funcion
+    #Given file name parse it and return the specified format
+    #Output is {uid:[[time,state,details],],}
+    #output optional CSV string of all data
+    @classmethod
+    def parseLog(self, log, retType):
+        retTypes = ['dict', 'csv', 'plot']
+        if retType not in retTypes:
+            raise ValueError(' retType must be in {}'.format(retTypes))
+        with stage('connstate_parse', retType=retType) as st:
+            linesRead, charsRead = log.linesRead, log.charsRead
+            if retType == 'csv':
+                retCSV = ''.join(self.iterExport(log, 'csv'))
+            else:
+                retDict = {}
+                for evt in self.iterEvents(log):  # Here we're building dictionary output
+                    if not evt.uid in retDict:
+                        retDict[evt.uid] = []
+                    retDict[evt.uid].append(evt.getList())
+            st.lines, st.bytes = log.linesRead - linesRead, log.charsRead - charsRead
         # Return format
         if retType == 'csv':
             return retCSV
         if retType == 'dict':
             return retDict
         if retType == 'plot':
-            return self.getPlot(retDict)
+            with stage('plot_build', plot='connstate'):
+                return self.getPlot(retDict)
         
     @classmethod
     def getPlot(self, graphDict, view=False):
         #Function showing an example interpretation of the parseLog functions
         #Features here: Step graph (using mode 'after'), circles on points for better visuals,
         #   Tooltips showing desc data, legend with 'hide' option, y_range using strings
+        # Bokeh is only imported once a plot is requested, the dict/csv paths don't need it
+        from bokeh.plotting import figure, output_file, show
+        from bokeh.models import ColumnDataSource
         output_file('graph.html') # Naming our output html doc
         TOOLTIPS = [
             ("Details", "@desc"),
@@ -186,15 +222,26 @@ class ConnStateParse():
 if __name__ == '__main__':
 
     parser = argparse.ArgumentParser(description='The connection health parser')
-    parser.add_argument('filename', type=str, help='syslog file to parse')
+    parser.add_argument('filenames', type=str, nargs='+',
+                        help='log file to parse.  Several logs of one incident are merged on timestamp')
+    parser.add_argument('--export', choices=['csv', 'jsonl'], help='stream events to stdout instead of plotting')
+    parser.add_argument('--last', type=float, metavar='HOURS',
+                        help='only the last HOURS of the log, read from its end where the format allows it')
 
     args = parser.parse_args()
-    filename = args.filename
 
 
     #Example usage of the class
-    log = logFile(filename)
+    since = timedelta(hours=args.last) if args.last else None
+    if len(args.filenames) == 1:
+        log = logFile(args.filenames[0], since=since)
+    else:
+        log = mergedLogFile(args.filenames, since=since)
     log.open()
+    if args.export:
+        ConnStateParse.exportLog(log, sys.stdout, args.export)  # Streaming export, constant memory
+        log.close()
+        sys.exit(0)
     resl = ConnStateParse.parseLog(log, 'dict')  # Here we get our standard output. {uid1:[[event1,...eventN],[...]],...uidN:[[]]}
     ConnStateParse.getPlot(resl, view=True)  # Plotting and viewing
     #ConnStateParse.parseLog(filename, 'log')  # Getting a plot back, to be viewed, saved, embedded
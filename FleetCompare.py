@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+"""
+Compare several router logs (e.g. every router at one site) side by side.
+
+Each log is ingested in its own worker process so the total ingest time is bounded by the slowest log rather than
+the sum of all of them.  Workers come from a fork server rather than being forked from the caller: the web app runs
+analysis threads, and forking while one of them holds a lock (Instrumentation, PlotCache) would leave the worker
+waiting on it forever.  Where shared memory is available the parsed timelines come back as SharedResults blocks
+instead of being pickled.  The connection state and signal timelines of every router are then drawn on a shared time
+axis.
+"""
+import argparse
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker
+from itertools import cycle
+from datetime import datetime
+from LogFile import logFile
+from ConnStateParse import ConnStateParse
+from SignalQualityParser import signalQualityParser
+from scan_log import ScanLog
+import SharedResults
+
+SIGNAL_METRICS = ['RSSI', 'SINR', 'RSRP', 'RSRQ', 'ECIO']
+COLORS = ['red', 'blue', 'green', 'deepskyblue', 'navy', 'rosybrown', 'darkgoldenrod', 'aquamarine', 'olive',
+          'orangered', 'orange', 'pink', 'purple', 'indigo']
+
+# Compiled once here.  The fork server preloads this module, so ingest workers inherit it instead of reloading the
+# database per log.
+scanner = ScanLog(None, None, log_database='log_messages.json')
+scanner.get_index()
+
+
+def _poolContext():
+    """Multiprocessing context for the ingest pool: a fork server (spawn where there is none, e.g. Windows)"""
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload([__name__])
+        return context
+    return multiprocessing.get_context('spawn')
+
+
+def ingestLog(logFileLoc, name=None, shared=False):
+    """Parse one log completely.  Runs inside a worker process, so everything returned must be picklable.
+       With shared=True the timelines are packed into shared memory and only its handle is returned ('shared')."""
+    result = {'name': name or os.path.basename(logFileLoc), 'connState': {}, 'signal': {}, 'problems': [],
+              'shared': None, 'error': None}
+
+    try:
+        log = logFile(logFileLoc)
+        log.open()
+    except FileNotFoundError as e:
+        result['error'] = 'Could not find file: {}'.format(e)
+        return result
+
+    try:
+        result['connState'] = ConnStateParse.parseLog(log, 'dict')
+        result['signal'] = signalQualityParser().parseLog(log, 'dict')
+    finally:
+        log.close()
+
+    result['problems'] = scanner.search_log(logFileLoc)
+
+    # Packed last, so nothing can fail between creating the block and handing it to the parent, which unlinks it
+    if shared:
+        packed = SharedResults.SharedResults.pack(result['connState'], result['signal'])
+        packed.close()
+        result['shared'] = packed.handle
+        result['connState'] = {}
+        result['signal'] = {}
+    return result
+
+
+def ingestLogs(logFileLocs, names=None, maxWorkers=None, shared=SharedResults.AVAILABLE):
+    """Ingest every log concurrently on a process pool.  Results come back in the same order as logFileLocs.
+       With shared memory, results hold a SharedResults under 'shared'; call releaseResults() once done with them."""
+    names = names or [None] * len(logFileLocs)
+    if not logFileLocs:
+        return []
+
+    if shared:
+        # Start the tracker before the workers, so they register their blocks with the same one that sees them
+        # unlinked here.  A tracker of their own would "clean up" the blocks when the pool shuts down.
+        resource_tracker.ensure_running()
+
+    workers = min(len(logFileLocs), maxWorkers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_poolContext()) as pool:
+        futures = [pool.submit(ingestLog, loc, name, shared) for loc, name in zip(logFileLocs, names)]
+
+        results = []
+        for future, loc, name in zip(futures, logFileLocs, names):
+            try:
+                result = future.result()
+                if result['shared'] is not None:
+                    result['shared'] = SharedResults.SharedResults.attach(result['shared'])
+                results.append(result)
+            except Exception as e:
+                # One bad log shouldn't take the whole comparison down
+                results.append({'name': name or os.path.basename(loc), 'connState': {}, 'signal': {},
+                                'problems': [], 'shared': None, 'error': 'Unable to analyze log: {}'.format(e)})
+    return results
+
+
+def releaseResults(results):
+    """Free the shared memory of ingested results.  Plots built from them must have been serialized already."""
+    for result in results:
+        if result.get('shared') is not None:
+            result['shared'].release()
+            result['shared'] = None
+
+
+def _connStateColumns(result):
+    """{uid: columns} of a router's connection state events, from shared memory or from the parsed dictionary"""
+    if result.get('shared') is not None:
+        return result['shared'].connStateColumns()
+    return dict((uid, dict(x=[evt[0] for evt in events],
+                           y=[evt[1] for evt in events],
+                           desc=[str(evt[2]) for evt in events],
+                           dtstr=[evt[3] for evt in events]))
+                for uid, events in result['connState'].items())
+
+
+def _signalColumns(result):
+    """{uid: {metric: columns}} of a router's signal readings, from shared memory or from the parsed dictionary"""
+    if result.get('shared') is not None:
+        return result['shared'].signalColumns()
+    columns = {}
+    for uid, metrics in result['signal'].items():
+        for metric, values in metrics.items():
+            columns.setdefault(uid, {})[metric] = dict(
+                x=[val[0] for val in values],
+                y=[val[1] for val in values],
+                desc=[str(val[2]) for val in values],
+                timeStr=[datetime.strftime(val[0], signalQualityParser.timeformat) for val in values])
+    return columns
+
+
+def _timeBounds(connColumns, signalColumns):
+    """Earliest and latest timestamp across every router, used as the shared x axis"""
+    bounds = []
+    for columns in connColumns:
+        bounds.extend(_extent(col['x']) for col in columns.values() if len(col['x']))
+    for columns in signalColumns:
+        for metrics in columns.values():
+            bounds.extend(_extent(col['x']) for col in metrics.values() if len(col['x']))
+    if not bounds:
+        return None
+    # Shared memory times are ms since the epoch, parsed dictionaries hold datetimes
+    bounds = [(_ms(low), _ms(high)) for low, high in bounds]
+    from bokeh.models import Range1d
+    return Range1d(min(low for low, high in bounds), max(high for low, high in bounds))
+
+
+def _extent(times):
+    if hasattr(times, 'min'):  # numpy view of shared memory
+        return times.min(), times.max()
+    return min(times), max(times)
+
+
+def _ms(when):
+    return SharedResults._ms(when) if isinstance(when, datetime) else float(when)
+
+
+def getComparisonPlots(results):
+    """Build one connection state figure and one figure per signal metric, all sharing the same time axis.
+       Every router/uid pair is a separate, hideable legend entry."""
+    connColumns = [_connStateColumns(result) for result in results]
+    signalColumns = [_signalColumns(result) for result in results]
+    xRange = _timeBounds(connColumns, signalColumns)
+    if xRange is None:
+        return []
+
+    # Bokeh is only imported once a plot is requested, ingesting doesn't need it
+    from bokeh.plotting import figure
+    from bokeh.models import ColumnDataSource
+
+    connStateRange = [x.name for x in ConnStateParse.WANState]
+    connPlot = figure(plot_width=1000, x_axis_type='datetime', x_range=xRange, y_range=connStateRange,
+                      tooltips=[("Router", "@router"), ("Details", "@desc"), ("Time", "@dtstr")])
+    connPlot.title.text = 'Connection State Comparison'
+
+    colors = cycle(COLORS)
+    for result, columns in zip(results, connColumns):
+        for uid, data in columns.items():
+            color = next(colors)
+            label = '{} {}'.format(result['name'], uid)
+            source = ColumnDataSource(data=dict(data, router=[result['name']] * len(data['y'])))
+            connPlot.step('x', 'y', source=source, line_width=2, mode='after', color=color, alpha=0.6, legend=label)
+            connPlot.circle('x', 'y', source=source, color=color, size=8, alpha=0.6, legend=label)
+    plots = [connPlot]
+
+    for metric in SIGNAL_METRICS:
+        p = None
+        colors = cycle(COLORS)
+        for result, columns in zip(results, signalColumns):
+            for uid, metrics in columns.items():
+                data = metrics.get(metric)
+                if data is None or not len(data['y']):
+                    continue
+                if p is None:
+                    p = figure(plot_width=1000, x_axis_type='datetime', x_range=xRange,
+                               tooltips=[("Router", "@router"), ("Quality", "@desc"), ("Value", "@y"),
+                                         ("DateTime", "@timeStr")])
+                    p.title.text = '{} Comparison'.format(metric)
+                color = next(colors)
+                source = ColumnDataSource(data=dict(data, router=[result['name']] * len(data['y'])))
+                p.step('x', 'y', source=source, line_width=2, mode='after', color=color, alpha=0.6,
+                       legend='{} {}'.format(result['name'], uid))
+        if p is not None:
+            plots.append(p)
+
+    # Format legends
+    for p in plots:
+        p.legend.location = "bottom_center"
+        p.legend.orientation = "horizontal"
+        p.legend.click_policy = "hide"
+    return plots
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the connection state and signal of several logs')
+    parser.add_argument('filenames', type=str, nargs='+', help='log files to compare')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes')
+
+    args = parser.parse_args()
+    from bokeh.plotting import output_file, show
+    from bokeh.layouts import column
+
+    fleet = ingestLogs(args.filenames, maxWorkers=args.workers)
+    for router in fleet:
+        if router['error']:
+            print('{}: {}'.format(router['name'], router['error']))
+    output_file('fleet.html')
+    try:
+        show(column(*getComparisonPlots(fleet)))
+    finally:
+        releaseResults(fleet)
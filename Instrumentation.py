@@ -0,0 +1,225 @@
+"""
+Per-stage performance instrumentation.
+
+Wrap a stage of the analysis in `with stage('scan') as st:` and optionally set st.lines / st.bytes.  When
+instrumentation is enabled every stage records its wall time, line and byte counts and peak memory into process wide
+totals (exposed in Prometheus text format by metricsText()) and into the current request's trace (used for the
+dashboard timing footer).  When disabled, stage() hands back a shared no-op object, so the cost is one function call
+and one global lookup per stage.
+
+Enable with the LOG_ANALYZER_METRICS environment variable:
+    LOG_ANALYZER_METRICS=1            timings, counts and process peak RSS
+    LOG_ANALYZER_METRICS=tracemalloc  also per-stage peak Python heap (slower, for investigations)
+
+Under a preforking server every worker only sees its own stages.  Set LOG_ANALYZER_METRICS_DIR (gunicorn.conf.py does)
+and each process also keeps its totals in a stages-<pid>.json file there, which metricsText() sums, so any worker
+answers a scrape with the totals of the whole server.  Files of exited workers are kept so the counters never go
+down; clearSharedMetrics() empties the directory when the server starts.
+"""
+import glob
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource  # Not available on Windows
+except ImportError:
+    resource = None
+
+METRIC_PREFIX = 'log_analyzer'
+
+_mode = os.environ.get('LOG_ANALYZER_METRICS', '').lower()
+ENABLED = _mode in ('1', 'true', 'yes', 'on', 'tracemalloc')
+
+METRICS_DIR = os.environ.get('LOG_ANALYZER_METRICS_DIR') or None
+
+_lock = threading.Lock()
+_stats = {}             # (stage name, sorted label items) -> [runs, seconds, lines, bytes, peak memory bytes]
+_statsPid = os.getpid() # A forked worker starts its own totals rather than repeating the master's
+_local = threading.local()
+
+
+def enable(enabled=True, traceMemory=False):
+    """Turn instrumentation on or off at runtime"""
+    global ENABLED
+    ENABLED = enabled
+    if enabled and traceMemory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def _peakRSS():
+    """Peak resident set size of this process in bytes, or 0 if unknown"""
+    if resource is None:
+        return 0
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class _NullStage(object):
+    """Returned by stage() when instrumentation is off.  Swallows everything."""
+    lines = 0
+    bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, exc, tb):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage(object):
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.lines = 0
+        self.bytes = 0
+
+    def __enter__(self):
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, exc, tb):
+        seconds = time.perf_counter() - self._start
+        if tracemalloc.is_tracing():
+            peakMemory = tracemalloc.get_traced_memory()[1]
+        else:
+            peakMemory = _peakRSS()
+
+        key = (self.name, tuple(sorted(self.labels.items())))
+        with _lock:
+            _checkPid()
+            stats = _stats.setdefault(key, [0, 0.0, 0, 0, 0])
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] += self.lines
+            stats[3] += self.bytes
+            stats[4] = max(stats[4], peakMemory)
+            if METRICS_DIR:
+                _writeShared()
+
+        trace = getattr(_local, 'trace', None)
+        if trace is not None:
+            trace.append({'stage': self.name, 'labels': self.labels, 'seconds': seconds, 'lines': self.lines,
+                          'bytes': self.bytes, 'peakMemory': peakMemory})
+        return False
+
+
+def _checkPid():
+    global _statsPid
+    if _statsPid != os.getpid():
+        _stats.clear()
+        _statsPid = os.getpid()
+
+
+def _sharedPath(pid):
+    return os.path.join(METRICS_DIR, 'stages-{}.json'.format(pid))
+
+
+def _writeShared():
+    """Replace this process's file in METRICS_DIR with its current totals.  Called with _lock held."""
+    path = _sharedPath(_statsPid)
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        with open(path + '.tmp', 'w') as f:
+            json.dump([[name, labels, stats] for (name, labels), stats in _stats.items()], f)
+        os.replace(path + '.tmp', path)
+    except OSError as e:
+        print('Unable to write stage metrics to {}. E: {}'.format(path, e))
+
+
+def _readShared():
+    """Totals of every process that wrote to METRICS_DIR, summed like _stats"""
+    totals = {}
+    for path in glob.glob(os.path.join(METRICS_DIR, 'stages-*.json')):
+        try:
+            with open(path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            continue  # Removed or replaced while listing
+        for name, labels, stats in entries:
+            key = (name, tuple(tuple(item) for item in labels))
+            total = totals.setdefault(key, [0, 0.0, 0, 0, 0])
+            for i in range(4):
+                total[i] += stats[i]
+            total[4] = max(total[4], stats[4])
+    return totals
+
+
+def clearSharedMetrics():
+    """Remove the totals of earlier runs from METRICS_DIR.  Call once when the server starts, before any worker."""
+    if METRICS_DIR:
+        for path in glob.glob(os.path.join(METRICS_DIR, 'stages-*.json*')):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def stage(name, **labels):
+    """Context manager timing one stage.  Extra keyword arguments become metric labels (e.g. translator=...)."""
+    if not ENABLED:
+        return _NULL_STAGE
+    return _Stage(name, labels)
+
+
+def startTrace():
+    """Start collecting the stages run by this thread, e.g. for one request"""
+    _local.trace = [] if ENABLED else None
+
+
+def endTrace():
+    """Stop collecting and return the stages recorded since startTrace(), in order"""
+    trace = getattr(_local, 'trace', None)
+    _local.trace = None
+    return trace or []
+
+
+def _formatLabels(name, labels):
+    items = [('stage', name)] + list(labels)
+    return ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in items)
+
+
+def metricsText():
+    """Totals for every stage seen by this process, or by every process sharing METRICS_DIR, in the Prometheus text
+       exposition format"""
+    with _lock:
+        _checkPid()
+        stats = _readShared() if METRICS_DIR else _stats
+        snapshot = sorted((key, list(values)) for key, values in stats.items())
+
+    metrics = [('stage_runs_total', 'counter', 'Number of times the stage ran', 0),
+               ('stage_seconds_total', 'counter', 'Wall time spent in the stage', 1),
+               ('stage_lines_total', 'counter', 'Lines processed by the stage', 2),
+               ('stage_bytes_total', 'counter', 'Bytes processed by the stage', 3),
+               ('stage_peak_memory_bytes', 'gauge', 'Peak memory observed at the end of the stage', 4)]
+
+    out = []
+    for metric, metricType, helpText, index in metrics:
+        fullName = '{}_{}'.format(METRIC_PREFIX, metric)
+        out.append('# HELP {} {}'.format(fullName, helpText))
+        out.append('# TYPE {} {}'.format(fullName, metricType))
+        for (name, labels), stats in snapshot:
+            out.append('{}{{{}}} {}'.format(fullName, _formatLabels(name, labels), stats[index]))
+
+    out.append('# HELP {}_process_peak_rss_bytes Peak resident set size of the process answering the scrape'.format(
+        METRIC_PREFIX))
+    out.append('# TYPE {}_process_peak_rss_bytes gauge'.format(METRIC_PREFIX))
+    out.append('{}_process_peak_rss_bytes{{pid="{}"}} {}'.format(METRIC_PREFIX, os.getpid(), _peakRSS()))
+    out.append('# HELP {}_instrumentation_enabled Whether stage instrumentation is on'.format(METRIC_PREFIX))
+    out.append('# TYPE {}_instrumentation_enabled gauge'.format(METRIC_PREFIX))
+    out.append('{}_instrumentation_enabled {}'.format(METRIC_PREFIX, int(ENABLED)))
+    return '\n'.join(out) + '\n'
+
+
+if _mode == 'tracemalloc':
+    enable(True, traceMemory=True)
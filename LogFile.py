@@ -7,7 +7,14 @@ from time import strftime, sleep
 import json
 import logging
 import tempfile
+import itertools
+import heapq
+import io
+import os
+import mmap
+from collections import OrderedDict, deque
 from datetime import datetime, timedelta
+from Instrumentation import stage
 
 
 # Base Class for all translators
@@ -18,6 +25,22 @@ class LogTranslator(object):
 	OUTPUT_FORMAT = '{}  {} S= {} \ufeff{}  --  {}\n'
 	# Out Format:   DATE IP    lvl      src      msg
 	OUTPUT_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+	# True if the source lists its newest line first.  Merging reads such sources backwards.
+	NEWEST_FIRST = False
+	# True if every line translates on its own (once primeTail has run), so a source can be read from its end
+	LINES_INDEPENDENT = False
+	# True if timestamps count from the start of the log (based at 1969-12-31) rather than the wall clock
+	RELATIVE_TIME = False
+
+	# Every subclass registers itself here in definition order; detection tries them in this order.
+	registry = []
+
+	def __init_subclass__(cls, register=True, **kwargs):
+		'''Self-register translator subclasses.  Pass register=False in the class statement to opt out
+		   (e.g. for an intermediate base class).'''
+		super().__init_subclass__(**kwargs)
+		if register:
+			LogTranslator.registry.append(cls)
 
 	def __init__(self):
 		super().__init__()
@@ -26,13 +49,12 @@ class LogTranslator(object):
 		self._abortParse = False		# Stop parsing the file (we're done with log content)
 
 	@classmethod
-	def detect(cls, logFile):
-		'''Detect the source file type for this translator.  Return True if the source logFile appears
-		   to be a log file of this type, False otherwise.  Note that you should reset the file pointer
-		   if you are going to return False, as another "detector" function will be invoked using the 
-		   same file pointer.  If you return True, it is acceptable to leave the pointer wherever you please,
-		   as the next method to be invoked will be the file translate method.'''
-		pass
+	def detect(cls, head):
+		'''Detect the source file type for this translator.  head is a list of the first few lines of the
+		   source (see DETECT_PEEK_LINES), read once and shared by every detector, so detectors never touch
+		   the file itself and detection works on pipes and upload streams.  Return True if the lines appear
+		   to come from a log file of this type, False otherwise.'''
+		return False
 
 	@property
 	def abort(self):
@@ -49,20 +71,26 @@ class LogTranslator(object):
 		   not match, return None to avoid writing anything to the output file.  Should be overridden.'''
 		return ln
 
+	def primeTail(self, head):
+		'''Called before a LINES_INDEPENDENT source is read backwards from its end, with the peeked head of the
+		   source.  Set up whatever state translation needs from the start of the file.  Return False if that
+		   isn't possible, and the source is translated from the top instead.'''
+		return True
 
-class SyslogTranslator(LogTranslator):
-	@classmethod
-	def detect(cls, logFile):
-		expr = re.compile(r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\s*(\d+.\d+.\d+.\d+)\s*S=\s*(\S*)\s*\W(\S*)\s*--\s*(.*)')
+	def selectLines(self, sourceFD, lines):
+		'''Return the lines of the source that should be translated.  lines replays the peeked head ahead of the
+		   rest of sourceFD.  Translators for multi-section exports may override this to skip straight to the
+		   part of the file they care about.'''
+		return lines
 
-		lineNo = logFile.tell()	 # Get the current file position
-		line = logFile.readline()
-		logFile.seek(lineNo)
 
-		if expr.match(line):
-			return True
-		else:
-			return False
+class SyslogTranslator(LogTranslator):
+	LINES_INDEPENDENT = True
+	REGEX = re.compile(r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\s*(\d+.\d+.\d+.\d+)\s*S=\s*(\S*)\s*\W(\S*)\s*--\s*(.*)')
+
+	@classmethod
+	def detect(cls, head):
+		return bool(head) and SyslogTranslator.REGEX.match(head[0]) is not None
 
 	def __init__(self):
 		super().__init__()
@@ -75,25 +103,28 @@ class SyslogTranslator(LogTranslator):
 
 class RouterUIExportTranslator(LogTranslator):
 	'''Translator for log files exported from router UI "Export Log" button'''
+	LINES_INDEPENDENT = True
 	REGEX = re.compile(r'(\S{3} \S{3} \d{2} \d{2}:\d{2}:\d{2} \d{4})\|([A-Z]*)\|([A-Za-z0-9_:\[\]\.]*)\|(.*)')
+	HEADER_REGEXES = [re.compile(r'Firmware Type: \S*'),
+					  re.compile(r'Firmware Version: \S*'),
+					  re.compile(r'Firmware Build Date: \S{3} \S{3}\s*\d{1,2} \d{2}:\d{2}:\d{2} \S{3} \d{4}'),
+					  re.compile(r'Product Name: \S*')]
 
 	def __init__(self):
 		super().__init__()
 
 	@classmethod
-	def detect(cls, logFile):
-		lineNo = logFile.tell()	 # Get the current file position
-		line = logFile.readline()
-		logFile.seek(lineNo)  		 # Restore the file pointer
-
+	def detect(cls, head):
+		if not head:
+			return False
 
-		if RouterUIExportTranslator.headerPresent(logFile) or RouterUIExportTranslator.REGEX.match(line):
+		if RouterUIExportTranslator.headerPresent(head) or RouterUIExportTranslator.REGEX.match(head[0]):
 			return True
 		else:
 			return False
 
 	@classmethod
-	def headerPresent(cls, logFile):
+	def headerPresent(cls, head):
 		'''
 		   Utility function to determine if the log file begins with the header at the start of the router log exported
 		   by the router UI.  Sample header:
@@ -102,21 +133,12 @@ class RouterUIExportTranslator(LogTranslator):
 				Firmware Build Date: Tue Nov 27 02:00:56 UTC 2018
 				Product Name: IBR900LP6
 		  '''
-		regexes = ['Firmware Type: \S*',
-				   'Firmware Version: \S*',
-				   'Firmware Build Date: \S{3} \S{3}\s*\d{1,2} \d{2}:\d{2}:\d{2} \S{3} \d{4}',
-				   'Product Name: \S*']
-		lineNo = 0
-
-		logFile.seek(0)  # Go back to start of file.
+		if len(head) < len(cls.HEADER_REGEXES):
+			return False
 
-		while lineNo < 4:
-			line = logFile.readline()
-			reg = re.compile(regexes[lineNo])
+		for reg, line in zip(cls.HEADER_REGEXES, head):
 			if not reg.match(line):
-				logFile.seek(0)  # Restore the file pointer.
 				return False
-			lineNo += 1
 		# If we get here and have matched all of the items, this sure appears to be a Router UI
 		return True
 
@@ -139,25 +161,104 @@ class RouterUIExportTranslator(LogTranslator):
 			return None
 
 
+class ncmSectionIndex(object):
+	'''Byte offsets of the sections of an NCM support export.  Each section is a title line underlined by a
+	   line of '=' of the same length ("Log" / "==="), followed by its content up to the next section header.
+	   The index is built with one regex pass over a memory map of the file, so any section can then be read
+	   on demand by seeking straight to it.'''
+	HEADER_REGEX = re.compile(rb'^([^\r\n=][^\r\n]*?)[ \t]*\r?\n(=+)[ \t]*\r?$', re.M)
+
+	def __init__(self, path, encoding='UTF-8'):
+		self.path = path
+		self.encoding = encoding
+		self.sections = OrderedDict()		# Title -> (content start offset, content end offset)
+		self._build()
+
+	def _build(self):
+		with open(self.path, 'rb') as f:
+			try:
+				mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+			except ValueError:
+				return  # Empty file, nothing to index
+			with mm:
+				headers = []
+				for mtch in self.HEADER_REGEX.finditer(mm):
+					title, underline = mtch.group(1), mtch.group(2)
+					if len(title) != len(underline):
+						continue
+					contentStart = mtch.end() + 1 if mm[mtch.end():mtch.end() + 1] == b'\n' else mtch.end()
+					headers.append((title.decode(self.encoding, 'replace'), mtch.start(), contentStart))
+				size = len(mm)
+
+		for i, (title, headerStart, contentStart) in enumerate(headers):
+			contentEnd = headers[i + 1][1] if i + 1 < len(headers) else size
+			# Keep the first occurrence if a title repeats
+			self.sections.setdefault(title, (contentStart, contentEnd))
+
+	def __contains__(self, title):
+		return title in self.sections
+
+	def names(self):
+		return list(self.sections)
+
+	def iterLines(self, title):
+		'''Lines of one section, newlines normalized to '\n' like a file opened in text mode'''
+		start, end = self.sections[title]
+		with open(self.path, 'rb') as f:
+			f.seek(start)
+			pos = start
+			for raw in f:
+				if pos >= end:
+					break
+				pos += len(raw)
+				yield raw.decode(self.encoding, 'replace').replace('\r\n', '\n')
+
+	def read(self, title):
+		'''Content of one section as a string'''
+		return ''.join(self.iterLines(title))
+
+	def readJSON(self, title):
+		'''Parse a section holding a JSON document (e.g. "Status", "Config")'''
+		return json.loads(self.read(title))
+
+	def readFields(self, title):
+		'''Parse a section of "Name: value" lines (e.g. "ECM Info") into a dictionary'''
+		fields = OrderedDict()
+		for ln in self.iterLines(title):
+			name, sep, value = ln.partition(':')
+			if sep and name.strip():
+				fields[name.strip()] = value.strip()
+		return fields
+
+
 class ncmSupportlogTranslator(LogTranslator):
 	'''Translator for log files exported from NCM "Export" method'''
+	NEWEST_FIRST = True
+
 	def __init__(self):
 		super().__init__()
 		# State variables
+		self.sections = None			# ncmSectionIndex, when the source could be indexed
 		self._lastDate = None
 		self._offsetDate = None
 		self._lastCorrectDate = None
 
 	@classmethod
-	def detect(cls, logFile):
-		lineNo = logFile.tell()
-		logFile.seek(0)
-		for i in range(2):
-			logFile.readline()
-		line = logFile.readline()
-		# Restore the line number
-		logFile.seek(lineNo)
-		return line == "ECM Info\n"
+	def detect(cls, head):
+		# The third line of an NCM export is the "ECM Info" section header
+		return len(head) > 2 and head[2].rstrip('\r\n') == "ECM Info"
+
+	def selectLines(self, sourceFD, lines):
+		'''Seek straight to the "Log" section when the source is a regular file.  Pipes and upload streams can't
+		   be indexed, and are read from the top until the "Status" section as before.'''
+		path = getattr(sourceFD, 'name', None)
+		if not isinstance(path, str) or not os.path.isfile(path):
+			return lines
+
+		self.sections = ncmSectionIndex(path)
+		if 'Log' not in self.sections:
+			return lines
+		return self.sections.iterLines('Log')
 	
 	def translateLine(self, ln):
 		ncm_rgx = r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\|\s*(\S*)\|\s*(\S*)\|(.*)$'
@@ -188,6 +289,8 @@ class ncmSupportlogTranslator(LogTranslator):
 
 class usbLogTranslator(LogTranslator):
 	'''Translator for logs collected via USB.'''
+	LINES_INDEPENDENT = True
+	RELATIVE_TIME = True
 	REGEX = re.compile(r'(\d+)\s*([a-z\.]+)\s*([A-Za-z0-9_:\[\]\.]+)\s*(.+)\n')
 	#       (date?) (source)  (level) (message)
 
@@ -198,15 +301,17 @@ class usbLogTranslator(LogTranslator):
 		self.logStartTime = None
 
 	@classmethod
-	def detect(cls, logFile):
-		lineNo = logFile.tell()	 # Get the current file position
-		line = logFile.readline()
-		logFile.seek(lineNo)  		 # Restore the file pointer
-
-		if usbLogTranslator.REGEX.match(line):
-			return True
-		else:
-			return False
+	def detect(cls, head):
+		return bool(head) and usbLogTranslator.REGEX.match(head[0]) is not None
+
+	def primeTail(self, head):
+		# Timestamps are relative to the first line of the log, which has to be seen before any other
+		for ln in head:
+			mtch = usbLogTranslator.REGEX.match(ln)
+			if mtch:
+				self.transformTimestamp(mtch.group(1))
+				return True
+		return False
 
 	def transformTimestamp(self, time):
 		if self.logStartTime is None:
@@ -239,9 +344,219 @@ class usbLogTranslator(LogTranslator):
 			return None
 
 
+class cliTailTranslator(LogTranslator):
+	'''Translator for logs captured from the router CLI "log -f" / tail output.  Lines before the clock is set
+	   carry a 1969 date, afterwards only the time of day is printed:
+			12/31/69 06:00:07 PM INFO syslogd started: BusyBox v1.24.1
+			01:29:48 PM INFO clock System time set to: 19:29:48 04/25/19 UTC
+			01:30:12 PM INFO WAN:47025ecf signal MC400LP6 (SIM1) on port modem1: 100%, RSSI:-47(dBm), ...'''
+	REGEX = re.compile(r'^(?:(\d{2}/\d{2}/\d{2}) )?(\d{1,2}:\d{2}:\d{2} [AP]M) ([A-Z]+) (\S+) ?(.*)$')
+	#                   (  date, optional )      (     time        ) (Level) (Source) (Message)
+	CLOCK_REGEX = re.compile(r'System time set to: (\d{2}:\d{2}:\d{2} \d{2}/\d{2}/\d{2}) UTC')
+
+	def __init__(self):
+		super().__init__()
+
+		# Lines without a date use the date of the most recent dated line (or the clock-set message)
+		self._curDate = datetime.strptime('1969-12-31', '%Y-%m-%d').date()
+		self._lastDateTime = None
+		# Undated lines right after 1969 dated ones: the clock was set, but its message with the date hasn't come yet
+		self._awaitingClock = False
+
+	@classmethod
+	def detect(cls, head):
+		return bool(head) and cliTailTranslator.REGEX.match(head[0]) is not None
+
+	def _clockSet(self, localDateTime, msg):
+		'''The clock message gives the new UTC date & time; derive the local date from its offset to our time.'''
+		clk = self.CLOCK_REGEX.search(msg)
+		if not clk:
+			return localDateTime
+
+		utc = datetime.strptime(clk.group(1), '%H:%M:%S %m/%d/%y')
+		offset = localDateTime - utc.replace(year=localDateTime.year, month=localDateTime.month, day=localDateTime.day)
+		# Time zone offsets fall between -12h and +14h, wrap anything outside of that by a day
+		if offset > timedelta(hours=14):
+			offset -= timedelta(days=1)
+		elif offset < timedelta(hours=-12):
+			offset += timedelta(days=1)
+		return utc + offset
+
+	def translateLine(self, ln):
+		mtch = cliTailTranslator.REGEX.match(ln)
+		if not mtch:
+			# This line doesn't match.  Don't return any text.
+			return None
+
+		date_str, time_str, level, source, msg = mtch.groups()
+		timeOfDay = datetime.strptime(time_str, '%I:%M:%S %p').time()
+
+		if date_str:
+			self._curDate = datetime.strptime(date_str, '%m/%d/%y').date()
+			self._awaitingClock = self._curDate.year == 1969
+		timestamp = datetime.combine(self._curDate, timeOfDay)
+
+		if not date_str and self._awaitingClock and self._lastDateTime and source != 'clock':
+			# The date is unknown until the clock message, keep the previous timestamp rather than put the line on
+			# the 1969 date out of order
+			timestamp = self._lastDateTime
+		elif not date_str and self._lastDateTime and timestamp < self._lastDateTime - timedelta(hours=12):
+			# Time of day went backwards a lot, we've rolled past midnight
+			self._curDate += timedelta(days=1)
+			timestamp += timedelta(days=1)
+
+		if source == 'clock':
+			timestamp = self._clockSet(timestamp, msg)
+			self._curDate = timestamp.date()
+			self._awaitingClock = False
+
+		self._lastDateTime = timestamp
+		return self.writeOutputLine(timestamp.strftime(self.OUTPUT_DATE_FORMAT), '0.0.0.0', level, source, msg)
+
+
+COMMON_LINE_REGEX = SyslogTranslator.REGEX
+
+# Number of lines read from the head of a source and shared by all of the translator detectors
+DETECT_PEEK_LINES = 8
+
+# Source lines translated between calls to a logFile's progress callback
+PROGRESS_LINES = 4096
+
+
+def peekLines(sourceFD, count=DETECT_PEEK_LINES):
+	'''Read the first few lines of a (possibly non-seekable) source.  Return the peeked lines and an iterator that
+	   replays them ahead of the rest of the source, so nothing needs to be re-read.'''
+	head = list(itertools.islice(sourceFD, count))
+	return head, itertools.chain(head, sourceFD)
+
+
+def detectTranslator(head):
+	'''Run each registered translator's detector against the peeked head of a source.  Return an instance of
+	   the first translator that recognizes it, or None if the format is unknown.'''
+	for trans in LogTranslator.registry:
+		if trans.detect(head):
+			return trans()
+	return None
+
+
+# Lines of one source may be this far out of order and still come out of a merge in timestamp order
+MERGE_WINDOW = timedelta(seconds=30)
+# Reading towards older lines stops once lines are this much older than the cutoff of a tail read
+TAIL_SLACK = MERGE_WINDOW
+
+
+def readLinesReversed(binaryFD, blockSize=1 << 16):
+	'''Yield the lines of a seekable binary file from last to first.  Blocks are read backwards from the end of
+	   the file, so memory is bounded by the block size and the longest line.'''
+	binaryFD.seek(0, io.SEEK_END)
+	pos = binaryFD.tell()
+	pending = b''	# Text after the read position that doesn't start at a line boundary yet
+	while pos > 0:
+		readSize = min(blockSize, pos)
+		pos -= readSize
+		binaryFD.seek(pos)
+		pending = binaryFD.read(readSize) + pending
+
+		# Everything after the first newline in pending is made of complete lines
+		cut = pending.find(b'\n')
+		if cut < 0:
+			continue
+		pieces = pending[cut + 1:].split(b'\n')
+		pending = pending[:cut + 1]
+		if pieces[-1]:
+			yield pieces[-1]	# Last line of the file, without a trailing newline
+		for piece in reversed(pieces[:-1]):
+			yield piece + b'\n'
+	if pending:
+		yield pending
+
+
+def _lineKey(line):
+	# Common format lines start with a sortable "YYYY-MM-DD HH:MM:SS" timestamp
+	return line[:19]
+
+
+_TIMESTAMP_PREFIX = re.compile(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}')
+
+
+def _records(lines):
+	'''Group lines into records: a timestamped line plus any continuation lines after it (e.g. a traceback).
+	   Every record ends with a newline, even when its source's last line didn't, so merged records stay apart.'''
+	record = None
+	for ln in lines:
+		if not ln.endswith('\n'):
+			ln += '\n'
+		if record is not None and not _TIMESTAMP_PREFIX.match(ln):
+			record += ln
+			continue
+		if record is not None:
+			yield record
+		record = ln
+	if record is not None:
+		yield record
+
+
+def _reorderLines(lines, window):
+	'''Put a stream of common format lines that is only slightly out of order (at most window) back in timestamp
+	   order.  Only the lines inside the window are held.  Lines later than that are passed on as soon as
+	   possible rather than dropped.  Continuation lines stay attached to the line before them.'''
+	held = []
+	newestKey = None
+	cutoffKey = None
+	for seq, record in enumerate(_records(lines)):
+		key = _lineKey(record)
+		if newestKey is None or key > newestKey:
+			newestKey = key
+			try:
+				cutoffKey = (datetime.strptime(key, LogTranslator.OUTPUT_DATE_FORMAT) - window).strftime(
+					LogTranslator.OUTPUT_DATE_FORMAT)
+			except ValueError:
+				cutoffKey = None
+		heapq.heappush(held, (key, seq, record))
+
+		while held and cutoffKey is not None and held[0][0] < cutoffKey:
+			yield heapq.heappop(held)[2]
+	while held:
+		yield heapq.heappop(held)[2]
+
+
+def mergeLines(sources, window=MERGE_WINDOW):
+	'''Heap based k-way merge of several streams of common format lines on their timestamps.  Each stream should
+	   be oldest first, give or take window.  Memory is bounded by one line per stream plus the lines inside the
+	   window, nothing is sorted as a whole.  Lines with equal timestamps keep the order of sources.'''
+	return heapq.merge(*[_reorderLines(src, window) for src in sources], key=_lineKey)
+
+
+def tokenizeLine(line):
+	'''Break a common format line into its component parts.
+	   Return:  dictionary with timestamp, ip, level, source and message, or None if the line doesn't match.'''
+	mtch = COMMON_LINE_REGEX.match(line)
+	if not mtch:
+		return None
+
+	return {'timestamp': mtch.group(1),
+			'ip': mtch.group(2),
+			'level': mtch.group(3),
+			'source': mtch.group(4),
+			'message': mtch.group(5)}
+
+
 class logFile(object):
-	def __init__(self, logFileName):
+	def __init__(self, logFileName, timeWindow=None, since=None):
+		'''logFileName is either a path, or an already open readable stream (pipe, stdin, upload stream).
+		   Binary streams are decoded as UTF-8.  timeWindow is an optional (start, end) pair of datetimes; only
+		   translated lines with start <= timestamp < end are kept.
+		   since only keeps the recent part of the log: a datetime, or a timedelta counted back from the newest
+		   line (use that for USB logs, their times are relative).  Where the format allows it the source is read
+		   from its newest line and reading stops at the cutoff, so the cost follows the window, not the file.'''
 		self.logFileName = logFileName
+		self.since = since
+		self.progress = None		# Optional callable, given the characters read so far every PROGRESS_LINES lines
+		self.linesRead = 0			# Lines and characters handed out by iteration so far, for stage counts
+		self.charsRead = 0
+		self.timeWindow = None
+		if timeWindow is not None:
+			self.timeWindow = tuple(when.strftime(LogTranslator.OUTPUT_DATE_FORMAT) for when in timeWindow)
 		self._fileFormat = None
 		self._sourceFD = None
 		self._tempFileName = None
@@ -256,6 +571,8 @@ class logFile(object):
 		# Get next line 
 		line = self.getNextLine()
 		if line:
+			self.linesRead += 1
+			self.charsRead += len(line)
 			if self._iterMode == 'raw':
 				return line
 			elif self._iterMode == 'tokenize':
@@ -267,53 +584,144 @@ class logFile(object):
 
 	def _translateFile(self):
 		# For now, just read source & write to temp all at once.  Ver 2 - produce on-demand.
-		self._autoDetectFormat()
+		head, lines = peekLines(self._sourceFD)
+		self._autoDetectFormat(head)
+
+		counts = [0, 0]  # Lines and characters read.  Characters equal bytes for the plain ASCII logs routers produce
+		inWindow = True
+		with stage('translate', translator=type(self._translator).__name__) as st:
+			if self.since is None:
+				translated = self._translateLines(self._translator.selectLines(self._sourceFD, lines), counts)
+			else:
+				translated = self._translateTail(head, lines, counts)
 
-		ln = self._sourceFD.readline()
+			for translated_line in translated:
+				if self.timeWindow is not None:
+					# Continuation lines (no timestamp) go wherever the line before them went
+					if _TIMESTAMP_PREFIX.match(translated_line):
+						inWindow = self.timeWindow[0] <= _lineKey(translated_line) < self.timeWindow[1]
+				if inWindow:
+					self._tempFD.write(translated_line)
+			st.lines, st.bytes = counts
 
-		while ln:
+		self.reset()
+		return tuple(counts)
+
+	def _translateLines(self, lines, counts):
+		'''Translate source lines in order until the translator is done.  counts is updated in place.'''
+		for ln in lines:
+			counts[0] += 1
+			counts[1] += len(ln)
+			if self.progress is not None and counts[0] % PROGRESS_LINES == 0:
+				self.progress(counts[1])
 			translated_line = self._translator.translateLine(ln)
 			if translated_line is not None:
-				self._tempFD.write(translated_line)
+				yield translated_line
 
 			if self._translator.abort:
 				break
 
-			ln = self._sourceFD.readline()
-
-		self.reset()
+	def _tailCutoff(self, newestKey):
+		'''(cutoff, stop) timestamp keys of a tail read: lines older than cutoff are dropped, and once a line older
+		   than stop is read no newer line is expected'''
+		if isinstance(self.since, timedelta):
+			cutoff = datetime.strptime(newestKey, LogTranslator.OUTPUT_DATE_FORMAT) - self.since
+		else:
+			cutoff = self.since
+		return (cutoff.strftime(LogTranslator.OUTPUT_DATE_FORMAT),
+				(cutoff - TAIL_SLACK).strftime(LogTranslator.OUTPUT_DATE_FORMAT))
+
+	def _translateTail(self, head, lines, counts):
+		'''Translated lines newer than self.since, read in whichever way the format allows'''
+		path = getattr(self._sourceFD, 'name', None)
+		if self._translator.LINES_INDEPENDENT and isinstance(path, str) and os.path.isfile(path) \
+				and self._translator.primeTail(head):
+			return self._tailBackward(path, counts)
+
+		translated = self._translateLines(self._translator.selectLines(self._sourceFD, lines), counts)
+		if self._translator.NEWEST_FIRST:
+			return self._tailNewestFirst(translated)
+		# Times depend on earlier lines (e.g. the date carried by CLI tail output), translate it all
+		return self._tailFiltered(translated)
+
+	def _tailNewestFirst(self, translated):
+		'''Newest first source (NCM export): translate from the top and stop once past the cutoff.  The
+		   translator sees the lines in their usual order, so the 1969 correction works as before.'''
+		newestKey = None
+		keep = True
+		for translated_line in translated:
+			if _TIMESTAMP_PREFIX.match(translated_line):
+				key = _lineKey(translated_line)
+				if newestKey is None or key > newestKey:
+					newestKey = key
+					cutoff, stop = self._tailCutoff(key)
+				if key < stop:
+					break
+				keep = key >= cutoff
+			if keep:
+				yield translated_line
+
+	def _tailBackward(self, path, counts):
+		'''Oldest first source whose lines translate independently: read it backwards in blocks from the end of the
+		   file and stop once past the cutoff.  Only the lines inside the window are held.'''
+		kept = []
+		pending = []  # Continuation lines, read before the timestamped line they belong to
+		newestKey = None
+		with open(path, 'rb') as f:
+			for raw in readLinesReversed(f):
+				counts[0] += 1
+				counts[1] += len(raw)
+				if self.progress is not None and counts[0] % PROGRESS_LINES == 0:
+					self.progress(counts[1])
+				ln = raw.decode('UTF-8', 'replace').replace('\r\n', '\n')
+				translated_line = self._translator.translateLine(ln)
+				if translated_line is None:
+					continue
+				if not _TIMESTAMP_PREFIX.match(translated_line):
+					pending.append(translated_line)
+					continue
+
+				key = _lineKey(translated_line)
+				if newestKey is None or key > newestKey:
+					newestKey = key
+					cutoff, stop = self._tailCutoff(key)
+				if key < stop:
+					break
+				if key >= cutoff:
+					kept.extend(pending)
+					kept.append(translated_line)
+				pending = []
+		return reversed(kept)
+
+	def _tailFiltered(self, translated):
+		'''Translate everything but only hold on to the records (line plus continuation lines) inside the window'''
+		held = deque()
+		newestKey = None
+		cutoff = None
+		for record in _records(translated):
+			key = _lineKey(record)
+			if _TIMESTAMP_PREFIX.match(record) and (newestKey is None or key > newestKey):
+				newestKey = key
+				cutoff = self._tailCutoff(key)[0]
+			held.append((key, record))
+			while held and cutoff is not None and held[0][0] < cutoff:
+				held.popleft()
+		for key, record in held:
+			if cutoff is None or key >= cutoff:
+				yield record
 
 	def _tokenize(self, line):
 		'''Break line into its component parts.
 		   Return:  dictionary with the following elements:  timestamp, IP, Host, Level, Source, Message'''
-		ret = {}
-		expr = re.compile(r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\s*(\d+.\d+.\d+.\d+)\s*S=\s*(\S*)\s*\W(\S*)\s*--\s*(.*)')
-
-		mtch = expr.match(line)
-		if mtch:
-			ret['timestamp'] = mtch.group(1)
-			ret['ip'] = mtch.group(2)
-			ret['level'] = mtch.group(3)
-			ret['source'] = mtch.group(4)
-			ret['message'] = mtch.group(5)
-
-		else:
+		ret = tokenizeLine(line)
+		if ret is None:
 			# This line didn't match our standard format.  Advance to the next line
 			ret = self.__next__()
 
 		return ret
 
-	def _autoDetectFormat(self):
-
-		logFileTranslators = [SyslogTranslator,  # Syslog listener as produced by WANTester
-							  RouterUIExportTranslator,  # Log file exported from router UI
-							  ncmSupportlogTranslator,		# NCM Support log
-							  usbLogTranslator]				# USB Log file
-
-		for trans in logFileTranslators:
-			if trans.detect(self._sourceFD):
-				self._translator = trans()
-				break
+	def _autoDetectFormat(self, head):
+		self._translator = detectTranslator(head)
 
 		if self._translator is None:
 			# Unrecognized format. Graphs wont work, interpret as router log to at least get message analysis
@@ -327,15 +735,37 @@ class logFile(object):
 
 		self._iterMode = mode.lower()
 
+	@property
+	def relativeTime(self):
+		'''True if the translated timestamps are relative to the start of the log (USB logs)'''
+		return getattr(self._translator, 'RELATIVE_TIME', False)
+
+	@property
+	def sections(self):
+		'''Section index of the source (ncmSectionIndex), for exports whose other sections (device info, status,
+		   config) can be read on demand.  None if the format has no sections or the source wasn't a file.'''
+		return getattr(self._translator, 'sections', None)
+
 	def open(self):
 		#open input file, read contents and modify to generic and write to new (temp) file.
-		self._sourceFD = open(self.logFileName, 'r')
+		ownsSource = not hasattr(self.logFileName, 'read')
+		if ownsSource:
+			self._sourceFD = open(self.logFileName, 'r')
+		elif isinstance(self.logFileName.read(0), bytes):
+			self._sourceFD = io.TextIOWrapper(self.logFileName, encoding='UTF-8', errors='replace')
+		else:
+			self._sourceFD = self.logFileName
 
 		self._tempFD = tempfile.NamedTemporaryFile(mode='w+', encoding='UTF-8')
 		self._tempFileName = self._tempFD.name
 
 		# Translate the file now that we've opened it.
-		self._translateFile()
+		with stage('logfile_open') as st:
+			try:
+				st.lines, st.bytes = self._translateFile()
+			finally:
+				if ownsSource:
+					self._sourceFD.close()
 		return
 
 	def reset(self):
@@ -350,3 +780,52 @@ class logFile(object):
 	def close(self):
 		#close log file -- automatically deletes tmp file??
 		self._tempFD.close()
+
+	def iterOldestFirst(self):
+		'''Translated lines, oldest first.  Sources the translator reports as newest first (NCM exports) are read
+		   backwards from the translated file rather than sorted.'''
+		self._tempFD.flush()
+		if not self._translator.NEWEST_FIRST:
+			with open(self._tempFileName, 'r', encoding='UTF-8') as f:
+				yield from f
+			return
+		with open(self._tempFileName, 'rb') as f:
+			for ln in readLinesReversed(f):
+				yield ln.decode('UTF-8', 'replace')
+
+
+class mergedLogFile(logFile):
+	'''Several sources covering one incident (e.g. a router UI export, an NCM export and a syslog capture), each
+	   translated by its own LogTranslator and merged on timestamp into one common format log.  Analyzers use it
+	   exactly like a logFile.'''
+	def __init__(self, logFileNames, window=MERGE_WINDOW, timeWindow=None, since=None):
+		super().__init__(logFileNames, timeWindow, since)
+		self.window = window
+		self.sources = [logFile(name, timeWindow, since) for name in logFileNames]
+
+	def open(self):
+		self._tempFD = tempfile.NamedTemporaryFile(mode='w+', encoding='UTF-8')
+		self._tempFileName = self._tempFD.name
+
+		with stage('logfile_merge', sources=len(self.sources)) as st:
+			try:
+				for source in self.sources:
+					source.open()
+				lineCount = 0
+				charCount = 0
+				for ln in mergeLines([source.iterOldestFirst() for source in self.sources], self.window):
+					lineCount += ln.count('\n')
+					charCount += len(ln)
+					self._tempFD.write(ln)
+				st.lines = lineCount
+				st.bytes = charCount
+			finally:
+				for source in self.sources:
+					if source._tempFD is not None:
+						source.close()
+		self.reset()
+
+	def iterOldestFirst(self):
+		self._tempFD.flush()
+		with open(self._tempFileName, 'r', encoding='UTF-8') as f:
+			yield from f
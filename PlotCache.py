@@ -0,0 +1,198 @@
+"""
+Cache of rendered plots, stored as serialized Bokeh JSON documents (bokeh.embed.json_item).
+
+Entries are keyed by analysis ID and plot type.  The analysis ID is a digest of the uploaded log's contents, so a page
+refresh, or the same log uploaded again, reuses the serialized JSON instead of rebuilding and re-serializing the
+figures.  Figures are only rebuilt when the underlying data changes.
+
+Entries live in a small in-memory LRU and on disk under UPLOAD_DIR/analysis-<id>/, so every worker process of a
+preforked server can share them.  The analyzed log itself can be kept there too (keepLog), so a time window of it
+can be analyzed later.  The upload sweeper expires the analysis directories like any other stale upload.
+
+The directory also records which process is running the analysis (claimRun), and the events of that run, so a
+stream reaching any worker follows the one run instead of starting another.
+"""
+import glob
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from UploadStorage import UPLOAD_DIR
+
+# Bump when plotting code changes so old serialized plots are not reused
+CACHE_VERSION = '1'
+MEMORY_ENTRIES = 64
+
+
+def analysisIdFor(logFileLoc, blockSize=1 << 20):
+    """Digest of a log's contents (plus CACHE_VERSION), used as its analysis ID"""
+    digest = hashlib.sha1(CACHE_VERSION.encode())
+    with open(logFileLoc, 'rb') as f:
+        for block in iter(lambda: f.read(blockSize), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def windowAnalysisId(analysisId, start, end):
+    """Analysis ID of the part of a log between two datetimes"""
+    window = '{}|{}|{}'.format(analysisId, start.isoformat(), end.isoformat())
+    return hashlib.sha1(window.encode()).hexdigest()
+
+
+def serializeFigure(fig):
+    """Serialize a bokeh model to a JSON document string that is safe to drop into a <script> block"""
+    from bokeh.embed import json_item  # Deferred so importing this module doesn't load bokeh
+    return json.dumps(json_item(fig)).replace('</', '<\\/')
+
+
+def _processAlive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Exists, owned by someone else
+    return True
+
+
+class PlotCache(object):
+    def __init__(self, directory=UPLOAD_DIR, memoryEntries=MEMORY_ENTRIES):
+        self.directory = directory
+        self.memoryEntries = memoryEntries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _dir(self, analysisId):
+        if not re.match(r'^[0-9a-f]+$', analysisId):
+            raise ValueError('Bad analysis ID: {}'.format(analysisId))
+        return os.path.join(self.directory, 'analysis-' + analysisId)
+
+    def _path(self, analysisId, plotType):
+        plotType = re.sub(r'[^\w-]', '_', plotType)
+        return os.path.join(self._dir(analysisId), plotType + '.json')
+
+    def logPath(self, analysisId):
+        """Where the log of an analysis is kept by keepLog()"""
+        return os.path.join(self._dir(analysisId), 'source.log')
+
+    def keepLog(self, analysisId, savedLocation):
+        """Move an upload next to its cached plots, so parts of it can be analyzed later without another upload.
+           It expires with the rest of the analysis directory.  Return the new location."""
+        path = self.logPath(analysisId)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(savedLocation, path)
+        return path
+
+    def runEventsPath(self, analysisId, token):
+        """File the events of run token of an analysis are appended to"""
+        return os.path.join(self._dir(analysisId), 'events-{}.jsonl'.format(token))
+
+    def claimRun(self, analysisId):
+        """Claim the analysis for this process.  Return (token, True) for a new run, whose events file has been
+           created, or (token, False) for the run a live process already holds.  token is None while that run is
+           still being set up, try again shortly."""
+        path = os.path.join(self._dir(analysisId), 'running')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        while True:
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    with open(path, 'r') as f:
+                        owner = f.read().split()
+                except FileNotFoundError:
+                    continue  # Released meanwhile
+                if len(owner) < 2:
+                    return None, False
+                if not _processAlive(int(owner[0])):
+                    # The worker died mid run (e.g. killed on timeout), take over
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                    continue
+                return owner[1], False
+
+            token = os.urandom(4).hex()
+            for stale in glob.glob(os.path.join(self._dir(analysisId), 'events-*.jsonl')):
+                try:
+                    os.remove(stale)
+                except FileNotFoundError:
+                    pass
+            open(self.runEventsPath(analysisId, token), 'w').close()
+            # Written after the events file exists, so whoever reads the token can follow it
+            with os.fdopen(fd, 'w') as f:
+                f.write('{} {}'.format(os.getpid(), token))
+            return token, True
+
+    def releaseRun(self, analysisId):
+        """Drop this process's claim once its run is finished.  Its events file stays for streams still reading it."""
+        try:
+            os.remove(os.path.join(self._dir(analysisId), 'running'))
+        except FileNotFoundError:
+            pass
+
+    def get(self, analysisId, plotType):
+        """Serialized entry for (analysisId, plotType), or None"""
+        key = (analysisId, plotType)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+        try:
+            with open(self._path(analysisId, plotType), 'r', encoding='UTF-8') as f:
+                value = f.read()
+        except (OSError, ValueError):
+            return None
+        self._remember(key, value)
+        return value
+
+    def put(self, analysisId, plotType, value):
+        """Store a serialized entry in memory and on disk"""
+        self._remember((analysisId, plotType), value)
+
+        path = self._path(analysisId, plotType)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename, so other workers never read a half written document
+            fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='UTF-8') as f:
+                f.write(value)
+            os.replace(tmpPath, path)
+        except OSError as e:
+            print('Unable to write plot cache {}. E: {}'.format(path, e))
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memoryEntries:
+                self._memory.popitem(last=False)
+
+    def getPlots(self, analysisId):
+        """All plots of an analysis, in page order, as [{'target':..., 'item':...}], or None if not cached"""
+        manifest = self.get(analysisId, 'manifest')
+        if manifest is None:
+            return None
+
+        plots = []
+        for plotType in json.loads(manifest):
+            item = self.get(analysisId, plotType)
+            if item is None:
+                return None
+            plots.append({'target': 'plot-' + plotType, 'item': item})
+        return plots
+
+    def putPlots(self, analysisId, plots):
+        """Store the plots built by the dashboard ([{'target': 'plot-<type>', 'item': json}]) and their order"""
+        plotTypes = []
+        for plot in plots:
+            plotType = plot['target'][len('plot-'):]
+            self.put(analysisId, plotType, plot['item'])
+            plotTypes.append(plotType)
+        # Written last, so a reader that finds the manifest finds every plot too
+        self.put(analysisId, 'manifest', json.dumps(plotTypes))
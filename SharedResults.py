@@ -0,0 +1,208 @@
+"""
+Parser results handed from a worker process to its parent through shared memory instead of pickling.
+
+A worker packs the output of ConnStateParse.parseLog(log, 'dict') and signalQualityParser.parseLog(log, 'dict') into
+one multiprocessing.shared_memory block of typed arrays:
+
+    eventTime   float64  ms since the epoch of every connection state event, grouped by uid
+    eventState  int32    codes into the string table (likewise eventDetail, eventTimeStr)
+    pointTime   float64  ms since the epoch of every signal reading, grouped by uid and metric
+    pointValue  float64  the readings (pointQuality, pointTimeStr are string codes)
+    stringData  uint8    UTF-8 bytes of every distinct string, stringOffsets int64 marks where each one starts
+
+Only a small handle (block name plus array offsets and the per-uid series table) is pickled back.  The parent
+attaches to the block and reads the arrays in place: connStateColumns() and signalColumns() hand times and values to
+bokeh as numpy views of the shared memory.  connState() and signal() rebuild the original dictionaries for anything
+else, such as exports.
+
+Lifecycle: the worker closes its mapping once packed, the parent calls release() when it is done with the results,
+which closes its mapping and unlinks the block.  POSIX only; Windows frees a block as soon as the worker closes it.
+"""
+import os
+from array import array
+from datetime import datetime, timedelta
+
+try:
+    from multiprocessing import shared_memory  # Python 3.8+
+except ImportError:
+    shared_memory = None
+
+AVAILABLE = shared_memory is not None and os.name == 'posix'
+EPOCH = datetime(1970, 1, 1)
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'  # signalQualityParser.timeformat
+
+
+# Blocks released while views of them (e.g. in a figure) were still alive.  Retried on every close().
+_unclosed = []
+
+
+def _ms(dt):
+    return (dt - EPOCH).total_seconds() * 1000
+
+
+class SharedResults(object):
+    def __init__(self, shm, layout):
+        self._shm = shm
+        self.layout = layout
+        self._strings = {}
+
+    @classmethod
+    def pack(cls, connState, signal):
+        """Copy parser dictionaries into a new shared memory block.  Runs in the worker."""
+        strings = {}
+
+        def intern(value):
+            code = strings.get(value)
+            if code is None:
+                code = strings[value] = len(strings)
+            return code
+
+        columns = dict((name, array(typecode)) for name, typecode in
+                       [('eventTime', 'd'), ('eventState', 'i'), ('eventDetail', 'i'), ('eventTimeStr', 'i'),
+                        ('pointTime', 'd'), ('pointValue', 'd'), ('pointQuality', 'i'), ('pointTimeStr', 'i')])
+
+        connSeries = []
+        for uid, events in connState.items():
+            start = len(columns['eventTime'])
+            for dt, state, details, dtstr in events:
+                columns['eventTime'].append(_ms(dt))
+                columns['eventState'].append(intern(state))
+                columns['eventDetail'].append(intern(str(details)))
+                columns['eventTimeStr'].append(intern(dtstr))
+            connSeries.append((uid, start, len(columns['eventTime'])))
+
+        signalSeries = []
+        for uid, metrics in signal.items():
+            for metric, values in metrics.items():
+                start = len(columns['pointTime'])
+                for val in values:
+                    columns['pointTime'].append(_ms(val[0]))
+                    columns['pointValue'].append(val[1])
+                    columns['pointQuality'].append(intern(str(val[2])))
+                    columns['pointTimeStr'].append(intern(val[0].strftime(TIME_FORMAT)))
+                signalSeries.append((uid, metric, start, len(columns['pointTime'])))
+
+        encoded = [value.encode('UTF-8') for value in strings]
+        offsets = array('q', [0])
+        for data in encoded:
+            offsets.append(offsets[-1] + len(data))
+        columns['stringOffsets'] = offsets
+        columns['stringData'] = array('B', b''.join(encoded))
+
+        # 8 byte aligned arrays, one after the other
+        arrays = {}
+        size = 0
+        for name, values in columns.items():
+            arrays[name] = (values.typecode, size, len(values))
+            size += (len(values) * values.itemsize + 7) // 8 * 8
+
+        shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        for name, values in columns.items():
+            typecode, offset, count = arrays[name]
+            shm.buf[offset:offset + count * values.itemsize] = memoryview(values).cast('B')
+
+        return cls(shm, {'arrays': arrays, 'connSeries': connSeries, 'signalSeries': signalSeries})
+
+    @property
+    def handle(self):
+        """Small picklable description of the block, for attach() in another process"""
+        return self._shm.name, self.layout
+
+    @classmethod
+    def attach(cls, handle):
+        """Map a block packed by another process.  Runs in the parent."""
+        name, layout = handle
+        return cls(shared_memory.SharedMemory(name=name), layout)
+
+    def array(self, name, start=0, end=None):
+        """Zero-copy typed memoryview of one array, or of the [start:end] part of it"""
+        typecode, offset, count = self.layout['arrays'][name]
+        itemsize = array(typecode).itemsize
+        end = count if end is None else end
+        return self._shm.buf[offset + start * itemsize:offset + end * itemsize].cast(typecode)
+
+    def numpyArray(self, name, start=0, end=None):
+        """Like array(), as a numpy view for bokeh.  numpy is only imported by the callers that plot."""
+        import numpy
+        return numpy.frombuffer(self.array(name, start, end), dtype=self.layout['arrays'][name][0])
+
+    def string(self, code):
+        """String number code of the interned string table"""
+        value = self._strings.get(code)
+        if value is None:
+            offsets = self.array('stringOffsets')
+            data = self.array('stringData', offsets[code], offsets[code + 1])
+            value = self._strings[code] = bytes(data).decode('UTF-8')
+        return value
+
+    def _stringList(self, name, start, end):
+        return [self.string(code) for code in self.array(name, start, end)]
+
+    def connStateColumns(self):
+        """{uid: {'x': ms, 'y': state, 'desc': details, 'dtstr': time}}, ready for a bokeh ColumnDataSource"""
+        columns = {}
+        for uid, start, end in self.layout['connSeries']:
+            columns[uid] = dict(x=self.numpyArray('eventTime', start, end),
+                                y=self._stringList('eventState', start, end),
+                                desc=self._stringList('eventDetail', start, end),
+                                dtstr=self._stringList('eventTimeStr', start, end))
+        return columns
+
+    def signalColumns(self):
+        """{uid: {metric: {'x': ms, 'y': value, 'desc': quality, 'timeStr': time}}}, ready for bokeh"""
+        columns = {}
+        for uid, metric, start, end in self.layout['signalSeries']:
+            columns.setdefault(uid, {})[metric] = dict(x=self.numpyArray('pointTime', start, end),
+                                                       y=self.numpyArray('pointValue', start, end),
+                                                       desc=self._stringList('pointQuality', start, end),
+                                                       timeStr=self._stringList('pointTimeStr', start, end))
+        return columns
+
+    def connState(self):
+        """Rebuild the ConnStateParse.parseLog(log, 'dict') dictionary"""
+        times = self.array('eventTime')
+        state, detail, timeStr = self.array('eventState'), self.array('eventDetail'), self.array('eventTimeStr')
+        result = {}
+        for uid, start, end in self.layout['connSeries']:
+            result[uid] = [[EPOCH + timedelta(milliseconds=times[i]), self.string(state[i]), self.string(detail[i]),
+                            self.string(timeStr[i])] for i in range(start, end)]
+        return result
+
+    def signal(self):
+        """Rebuild the signalQualityParser.parseLog(log, 'dict') dictionary"""
+        times, values, quality = self.array('pointTime'), self.array('pointValue'), self.array('pointQuality')
+        result = {}
+        for uid, metric, start, end in self.layout['signalSeries']:
+            result.setdefault(uid, {})[metric] = [[EPOCH + timedelta(milliseconds=times[i]), values[i],
+                                                   self.string(quality[i])] for i in range(start, end)]
+        return result
+
+    def close(self):
+        """Unmap the block from this process.  Arrays handed out by the *Columns() methods must not be used
+           afterwards.  If they are still referenced the block is unmapped by a later close(), once they are gone."""
+        for shm in list(_unclosed):
+            try:
+                shm.close()
+                _unclosed.remove(shm)
+            except BufferError:
+                pass
+
+        try:
+            self._shm.close()
+        except BufferError:
+            _unclosed.append(self._shm)
+
+    def release(self):
+        """Done with the results: unmap and free the block"""
+        self.close()
+        try:
+            self._shm.unlink()
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, exc, tb):
+        self.release()
+        return False
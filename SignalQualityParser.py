@@ -3,8 +3,7 @@ import sys
 import re
 from time import strftime, sleep 
 from LogFile import logFile
-from bokeh.plotting import figure, output_file, show
-from bokeh.models import ColumnDataSource, HoverTool, LinearAxis
+from Instrumentation import stage
 from datetime import datetime
 
 class signalQualityParser(object):
@@ -25,9 +24,13 @@ class signalQualityParser(object):
 		if format not in formats:
 			raise ValueError(' Format {} is not in {}'.format(format, formats))
 
-		data = self._parseLog(log)
+		with stage('signal_parse', format=format) as st:
+			linesRead, charsRead = log.linesRead, log.charsRead
+			data = self._parseLog(log)
+			st.lines, st.bytes = log.linesRead - linesRead, log.charsRead - charsRead
 		if format == 'plot':
-			data = self._getPlot(data, view=view)
+			with stage('plot_build', plot='signal'):
+				data = self._getPlot(data, view=view)
 		#turn data into a plot
 		return data
 
@@ -115,6 +118,9 @@ class signalQualityParser(object):
 		#Function showing an example interpretation of the parseLog functions
 		#Features here: Step graph (using mode 'after'), circles on points for better visuals,
 		#   Tooltips showing desc data, legend with 'hide' option, y_range using strings
+		# Bokeh is only imported once a plot is requested, the dict/csv paths don't need it
+		from bokeh.plotting import figure, output_file, show
+		from bokeh.models import ColumnDataSource
 		TOOLTIPS = [
 			("Quality", "@desc"),
 			("dBm", "@y"),
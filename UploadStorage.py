@@ -0,0 +1,74 @@
+"""
+Storage for uploaded log files.
+
+Every upload is saved into its own private directory under UPLOAD_DIR, so concurrent uploads of files with the same
+name (every router calls its export the same thing) never overwrite each other.  Stale uploads left behind by
+crashed or abandoned requests are removed by a background sweeper that deletes a bounded number of entries per pass.
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+UPLOAD_DIR = 'logFiles/'
+STALE_AGE = 60 * 60         # Seconds before an abandoned upload is considered stale
+SWEEP_INTERVAL = 5 * 60     # Seconds between cleanup passes
+SWEEP_LIMIT = 100           # Max entries removed per pass, keeps each pass short on a badly backed up disk
+
+
+def saveUpload(upload):
+    """Save a werkzeug FileStorage into a fresh per-request directory.  Return the saved path."""
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    requestDir = tempfile.mkdtemp(prefix='upload-', dir=UPLOAD_DIR)
+    savedLocation = os.path.join(requestDir, os.path.basename(upload.filename) or 'log')
+    upload.save(savedLocation)
+    return savedLocation
+
+
+def removeUpload(savedLocation):
+    """Remove an upload saved by saveUpload along with its private directory"""
+    requestDir = os.path.dirname(savedLocation)
+    if os.path.dirname(os.path.normpath(requestDir)) == os.path.normpath(UPLOAD_DIR):
+        shutil.rmtree(requestDir, ignore_errors=True)
+    else:
+        os.remove(savedLocation)
+
+
+def cleanStaleUploads(maxAge=STALE_AGE, limit=SWEEP_LIMIT):
+    """Remove at most limit entries in UPLOAD_DIR older than maxAge seconds.  Return the number removed."""
+    cutoff = time.time() - maxAge
+    removed = 0
+    try:
+        entries = os.scandir(UPLOAD_DIR)
+    except FileNotFoundError:
+        return 0
+
+    with entries:
+        for entry in entries:
+            if removed >= limit:
+                break
+            try:
+                if entry.stat(follow_symlinks=False).st_mtime > cutoff:
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                else:
+                    os.remove(entry.path)
+                removed += 1
+            except OSError as e:
+                print('Unable to remove stale upload {}. E: {}'.format(entry.path, e))
+    return removed
+
+
+def _sweep(interval, maxAge, limit):
+    while True:
+        cleanStaleUploads(maxAge, limit)
+        time.sleep(interval)
+
+
+def startCleanupThread(interval=SWEEP_INTERVAL, maxAge=STALE_AGE, limit=SWEEP_LIMIT):
+    """Start the background stale upload sweeper.  The thread is a daemon and dies with the process."""
+    sweeper = threading.Thread(target=_sweep, args=(interval, maxAge, limit), name='upload-cleanup', daemon=True)
+    sweeper.start()
+    return sweeper
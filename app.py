@@ -1,33 +1,188 @@
-from flask import Flask, render_template, flash, redirect, url_for, session
-from bokeh.plotting import figure
-from bokeh.embed import components
-from forms import logFileForm
+from flask import Flask, render_template, flash, redirect, url_for, session, Response, request, abort
+from flask import send_from_directory
+from werkzeug.utils import secure_filename
+from forms import logFileForm, eventExportForm, fleetLogForm
 from ConnStateParse import ConnStateParse
-from LogFile import logFile
+from LogFile import logFile, LogTranslator
 from SignalQualityParser import signalQualityParser
 from scan_log import ScanLog
-from os import remove
+from ActivityHistogram import ActivityHistogram
+from FleetCompare import ingestLogs, getComparisonPlots, releaseResults
+from UploadStorage import saveUpload, removeUpload
+import Instrumentation
+from Instrumentation import stage
+from AssetCache import PrecompressedFile, bokehAssets
+from PlotCache import PlotCache, analysisIdFor, windowAnalysisId, serializeFigure
+from datetime import datetime
+import os
+import json
+import threading
+import time
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = '\x7f[\xce\x97\xf9\x86\x1b\x92YBx/7\xdcX^\xea\xd5\xc4\t~\x8c\xbe\x02'
 
 scanner = ScanLog(None, None, log_database='./log_messages.json')
+scanner.get_index()  # Load the database & compile patterns at import, so preforked workers share them
+
+logMessages = PrecompressedFile(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'log_messages.json'),
+                                'application/json')
+
+BOKEH_ASSET_MAX_AGE = 365 * 24 * 60 * 60  # Asset URLs carry the bokeh version, so they never go stale
+
+plotCache = PlotCache()
+
+# Bigger logs only get the activity heatmap at first, the user then picks a window (or the whole log) to analyze
+FULL_ANALYSIS_BYTES = 20 * 1024 * 1024
+
+STREAM_KEEPALIVE = 15  # Seconds between comments on a quiet event stream, so proxies don't close it
+
+
+STREAM_POLL = 0.2  # Seconds between checks of a run's events file for new events
+
+
+class AnalysisRun(object):
+    """Events of one analysis run, appended to a file in its analysis directory.  Streams in any worker process
+       follow the file, so a reconnect, refresh or second tab follows the run instead of starting another one."""
+    def __init__(self, analysisId, token):
+        self.token = token  # Event ids carry it, so a reconnect only resumes the run it came from
+        self.path = plotCache.runEventsPath(analysisId, token)
+        self.finished = False
+        self._lock = threading.Lock()
+
+    def emit(self, event, data):
+        """Append an event.  Only the process that claimed the run emits."""
+        with self._lock:
+            with open(self.path, 'a', encoding='UTF-8') as f:
+                f.write(json.dumps([event, data]) + '\n')
+            self.finished = self.finished or event in ('done', 'failed')
+
+    def follow(self, start=0, timeout=STREAM_KEEPALIVE):
+        """Yield (number, event, data) from event number start on, or None after timeout seconds without one.
+           Stops after the done or failed event.  Ends early if the file is gone (a newer run replaced it), the
+           EventSource then reconnects to the newer run."""
+        try:
+            f = open(self.path, 'r', encoding='UTF-8')
+        except FileNotFoundError:
+            return
+        with f:
+            i = 0
+            pending = ''
+            quiet = 0.0
+            while True:
+                pending += f.readline()
+                if not pending.endswith('\n'):
+                    # Nothing new, or the writer is halfway through a line
+                    time.sleep(STREAM_POLL)
+                    quiet += STREAM_POLL
+                    if quiet >= timeout:
+                        quiet = 0.0
+                        yield None
+                    continue
+                event, data = json.loads(pending)
+                pending = ''
+                quiet = 0.0
+                if i >= start:
+                    yield i, event, data
+                i += 1
+                if event in ('done', 'failed'):
+                    return
 
 
 ## View functions
 @app.route('/')
 def showDashboard():
     form = logFileForm()
+    exportForm = eventExportForm()
 
     plots = []
     analysis = ''
+    activity = None
+    deferred = False
+    streamUrl = None
     fileNameLoc = session.pop('logFileLoc', None)
     if fileNameLoc:
-        plots = generatePlots(fileNameLoc)
-        analysis = search_log(fileNameLoc)
-        remove(fileNameLoc)
+        analysisId = analysisIdFor(fileNameLoc)
+        plotCache.keepLog(analysisId, fileNameLoc)  # Kept so a window of it can be analyzed later
+        removeUpload(fileNameLoc)
+        session['analysisId'] = analysisId  # Refreshing the page redraws this analysis from the plot cache
+        # The page comes back right away, progress and results follow over /AnalysisEvents
+        streamUrl = url_for('analysisEvents')
+    elif session.get('analysisId'):
+        analysisId = session['analysisId']
+        if not os.path.exists(plotCache.logPath(analysisId)):
+            # The sweeper expired the analysis directory, the log and its cached results with it
+            session.pop('analysisId')
+            flash("The log is no longer available, please upload it again")
+        elif not analysisCached(analysisId):
+            # Refreshed while the analysis is still running, follow it again
+            streamUrl = url_for('analysisEvents')
+        else:
+            plots = plotCache.getPlots(analysisId)
+            deferred = plots is None  # Large log, only the activity heatmap was built
+            plots = plots or []
+            analysis = json.loads(plotCache.get(analysisId, 'problems') or '[]')
+            activity = cachedActivity(analysisId)
 
-    return render_template('dashboard.html', plots=plots, form=form, analysis=analysis)
+    return render_template('dashboard.html', plots=plots, form=form, exportForm=exportForm, analysis=analysis,
+                           activity=activity, deferred=deferred, window=None, timings=[], streamUrl=streamUrl)
+
+
+@app.route('/AnalysisEvents', methods=['GET'])
+def analysisEvents():
+    """Server-sent events with the progress and the partial results of the analysis of the last uploaded log.
+       Streams of an analysis that is already running follow it, a reconnect resumes after its Last-Event-ID."""
+    analysisId = session.get('analysisId')
+    logLoc = plotCache.logPath(analysisId) if analysisId else None
+    if not logLoc or not os.path.exists(logLoc):
+        abort(404)
+
+    run = startAnalysis(logLoc, analysisId)
+    start = 0
+    lastId = request.headers.get('Last-Event-ID', '').split('-')
+    if len(lastId) == 2 and lastId[0] == run.token and lastId[1].isdigit():
+        start = int(lastId[1]) + 1
+
+    def generate():
+        for item in run.follow(start):
+            if item is None:
+                yield ': keepalive\n\n'
+                continue
+            i, event, data = item
+            yield 'id: {}-{}\nevent: {}\ndata: {}\n\n'.format(run.token, i, event, json.dumps(data))
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/Analyze', methods=['GET'])
+def analyzeWindow():
+    """Analyze the last uploaded log, or just the window between the start and end query arguments"""
+    analysisId = session.get('analysisId')
+    logLoc = plotCache.logPath(analysisId) if analysisId else None
+    if not logLoc or not os.path.exists(logLoc):
+        flash("The log is no longer available, please upload it again")
+        return redirect(url_for('showDashboard'))
+
+    timeWindow = None
+    if request.args.get('start') and request.args.get('end'):
+        try:
+            timeWindow = tuple(datetime.strptime(request.args[arg], LogTranslator.OUTPUT_DATE_FORMAT)
+                               for arg in ('start', 'end'))
+        except ValueError:
+            abort(400)
+
+    Instrumentation.startTrace()
+    activity = generateActivity(logLoc, analysisId)
+    if timeWindow:
+        plots, analysis = analyzeLog(logLoc, windowAnalysisId(analysisId, *timeWindow), timeWindow)
+    else:
+        plots, analysis = analyzeLog(logLoc, analysisId)
+    timings = Instrumentation.endTrace()
+
+    window = [when.strftime(LogTranslator.OUTPUT_DATE_FORMAT) for when in timeWindow] if timeWindow else None
+    return render_template('dashboard.html', plots=plots, form=logFileForm(), exportForm=eventExportForm(),
+                           analysis=analysis, activity=activity, deferred=False, window=window, timings=timings)
 
 
 @app.route('/UploadFile', methods=['POST'])
@@ -36,8 +191,7 @@ def uploadFile():
 
     if form.validate_on_submit():
         logFileName = form.logFile.data.filename
-        savedLocation = 'logFiles/' + logFileName
-        form.logFile.data.save(savedLocation)
+        savedLocation = saveUpload(form.logFile.data)
         flash("LogFile: {} has been submitted".format(logFileName))
 
         session.pop('logFileLoc', None)  # clear old logFileLoc from session
@@ -45,11 +199,112 @@ def uploadFile():
 
     return redirect(url_for('showDashboard'))
 
+@app.route('/Fleet')
+def showFleet():
+    form = fleetLogForm()
+
+    plots = []
+    routers = []
+    fleetLogs = session.pop('fleetLogs', None)
+    if fleetLogs:
+        fileNameLocs, names = zip(*fleetLogs)
+        try:
+            routers = ingestLogs(fileNameLocs, names)  # One worker process per log
+        finally:
+            for fileNameLoc in fileNameLocs:
+                removeUpload(fileNameLoc)
+
+        try:
+            comparisonPlots = getComparisonPlots(routers)
+            if comparisonPlots:
+                # The figures share one time axis, so they have to be embedded as a single document
+                from bokeh.embed import components
+                with stage('components', page='fleet'):
+                    script, divs = components(comparisonPlots)
+                plots = [[script] + list(divs)]
+        finally:
+            releaseResults(routers)  # The plots are serialized, the shared memory behind them can go
+
+    return render_template('fleet.html', plots=plots, form=form, routers=routers)
+
+
+@app.route('/UploadFleet', methods=['POST'])
+def uploadFleet():
+    form = fleetLogForm()
+
+    if form.validate_on_submit():
+        fleetLogs = []
+        for upload in form.logFiles.data:
+            fleetLogs.append((saveUpload(upload), upload.filename))
+        flash("{} log files have been submitted".format(len(fleetLogs)))
+
+        session.pop('fleetLogs', None)  # clear old fleet logs from session
+        session['fleetLogs'] = fleetLogs
+
+    return redirect(url_for('showFleet'))
+
+
+@app.route('/ExportEvents', methods=['POST'])
+def exportEvents():
+    """Stream the connection state events of an uploaded log back as a CSV or JSON Lines download"""
+    form = eventExportForm()
+
+    if not form.validate_on_submit():
+        flash("Select a log file to export")
+        return redirect(url_for('showDashboard'))
+
+    exportType = form.exportType.data
+    log = logFile(form.logFile.data.stream)
+    log.open()  # Translation spools to a temp file, so the upload isn't needed once the response starts
+
+    def generate():
+        try:
+            for chunk in ConnStateParse.iterExport(log, exportType):
+                yield chunk
+        finally:
+            log.close()
+
+    mimetype = 'text/csv' if exportType == 'csv' else 'application/x-ndjson'
+    # The upload's name is client controlled, keep quotes/CR/LF and path parts out of the header
+    baseName = secure_filename(form.logFile.data.filename or '').rsplit('.', 1)[0] or 'log'
+    downloadName = '{}-events.{}'.format(baseName, exportType)
+    return Response(generate(), mimetype=mimetype,
+                    headers={'Content-Disposition': 'attachment; filename="{}"'.format(downloadName)})
+
+
+@app.route('/metrics', methods=['GET'])
+def showMetrics():
+    """Per-stage timings, line/byte counts and peak memory for this process in Prometheus text format"""
+    return Response(Instrumentation.metricsText(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/log_messages', methods=['GET'])
 def showMessages():
-    with open("log_messages.json", "r") as f:
-        j = f.read()
-    return j
+    # Served from memory, gzipped, with ETag/Last-Modified so repeat requests get a 304
+    return logMessages.response(request)
+
+
+@app.route('/bokeh/<version>/<path:filename>', methods=['GET'])
+def bokehAsset(version, filename):
+    """BokehJS served from the installed bokeh package, cacheable for a year under its versioned URL"""
+    bokehVersion, staticDir, jsFiles, cssFiles = bokehAssets()
+    if version != bokehVersion or filename not in jsFiles + cssFiles:
+        abort(404)
+    resp = send_from_directory(staticDir, filename)
+    resp.cache_control.no_cache = None
+    resp.cache_control.public = True
+    resp.cache_control.max_age = BOKEH_ASSET_MAX_AGE
+    return resp
+
+
+@app.context_processor
+def bokehResources():
+    """URLs of the BokehJS files for layout.html.  Bokeh is only imported when a page is first rendered."""
+    def urls(kind):
+        bokehVersion, staticDir, jsFiles, cssFiles = bokehAssets()
+        files = jsFiles if kind == 'js' else cssFiles
+        return [url_for('bokehAsset', version=bokehVersion, filename=name) for name in files]
+    return {'bokehUrls': urls}
 
 
 @app.errorhandler(404)
@@ -62,24 +317,92 @@ def server_error(e):
     return render_template('500.html'), 500
 
 
-def generatePlots(logFileLoc):
-    plots = []
-    try:
-        log = logFile(logFileLoc)
-        log.open()
-    except FileNotFoundError as e:
-        print('Could not find file: {}'.format(e))
-        return []
+def analyzeLog(logFileLoc, analysisId, timeWindow=None):
+    """Plots and problem messages of a log (or of the timeWindow part of it), cached under analysisId"""
+    plots = generatePlots(logFileLoc, analysisId, timeWindow)
+    cachedProblems = plotCache.get(analysisId, 'problems')
+    if cachedProblems is not None:
+        return plots, json.loads(cachedProblems)
+
+    analysis = scanner.search_log(logFileLoc, time_window=timeWindow)
+    plotCache.put(analysisId, 'problems', json.dumps(analysis))
+    return plots, analysis
+
+
+def cachedActivity(analysisId):
+    """Activity heatmaps and hot windows of an analysis from the plot cache, or None"""
+    cached = plotCache.get(analysisId, 'activity')
+    return json.loads(cached) if cached is not None else None
+
 
+def activityFromLog(log):
+    """Activity heatmaps and busiest windows of an open log,
+       {'plots': [{'target': div id, 'item': json}], 'hotWindows': [[start, end, lines]]}"""
+    hist = ActivityHistogram.fromLog(log)
+
+    activity = {'plots': [], 'hotWindows': []}
+    with stage('components', page='dashboard'):
+        for name, figure in zip(['sources', 'levels'], hist.getPlots()):
+            activity['plots'].append({'target': 'plot-activity-' + name, 'item': serializeFigure(figure)})
+    for start, end, lines in hist.hotWindows():
+        activity['hotWindows'].append([start.strftime(LogTranslator.OUTPUT_DATE_FORMAT),
+                                       end.strftime(LogTranslator.OUTPUT_DATE_FORMAT), lines])
+    return activity
+
+
+def generateActivity(logFileLoc, analysisId):
+    """Activity heatmaps and busiest windows of a log (see activityFromLog), from the plot cache if already built"""
+    activity = cachedActivity(analysisId)
+    if activity is not None:
+        return activity
+
+    log = logFile(logFileLoc)
+    log.open()
+    activity = activityFromLog(log)
+    log.close()
+
+    plotCache.put(analysisId, 'activity', json.dumps(activity))
+    return activity
+
+
+def iterPlots(log):
+    """Build the dashboard plots of an open log, yielding each {'target': div id, 'item': json} once serialized"""
     connStatePlot = ConnStateParse.parseLog(log, 'plot')
-    plots.append(components(connStatePlot))
+    with stage('components', page='dashboard'):
+        item = serializeFigure(connStatePlot)
+    yield {'target': 'plot-connstate', 'item': item}
 
     sigQParse = signalQualityParser()
     sigQPlot = sigQParse.parseLog(log, 'plot')
+    for i, figure in enumerate(sigQPlot):
+        with stage('components', page='dashboard'):
+            item = serializeFigure(figure)
+        yield {'target': 'plot-signal-{}'.format(i), 'item': item}
 
-    for figure in sigQPlot:
-        plots.append(components(figure))
 
+def generatePlots(logFileLoc, analysisId=None, timeWindow=None):
+    """Serialized Bokeh JSON documents for the dashboard plots, [{'target': div id, 'item': json}].
+       Plots already rendered for this analysis ID are taken from the plot cache instead of being rebuilt."""
+    if analysisId:
+        cached = plotCache.getPlots(analysisId)
+        if cached is not None:
+            return cached
+
+    try:
+        # Read from the end of the log back to the start of the window, where the format allows it
+        log = logFile(logFileLoc, timeWindow, since=timeWindow[0] if timeWindow else None)
+        log.open()
+    except FileNotFoundError as e:
+        print('Could not find file: {}'.format(e))
+        return []
+
+    try:
+        plots = list(iterPlots(log))
+    finally:
+        log.close()
+
+    if analysisId:
+        plotCache.putPlots(analysisId, plots)
 
     # this line breaks things on windows
     # remove(logFileLoc)  # don't want these files to build up, remove after parse
@@ -87,18 +410,109 @@ def generatePlots(logFileLoc):
     return plots
 
 
-def search_log(logFileLoc):
-    """Search Log file for problematic messages"""
-    problem_messages = []
+def analysisCached(analysisId):
+    """True once everything the stream of an analysis produces is in the plot cache.  The log must still be kept."""
+    if plotCache.get(analysisId, 'problems') is not None:
+        return True
+    # Large logs stop after the activity heatmap
+    return cachedActivity(analysisId) is not None and \
+        os.path.getsize(plotCache.logPath(analysisId)) > FULL_ANALYSIS_BYTES
+
 
+def startAnalysis(logFileLoc, analysisId):
+    """The AnalysisRun of a log.  Unless some worker process is already running it, it is claimed and started on a
+       thread of this one.  The thread lets progress be sent while the analysis is inside a parser.  Once finished
+       the claim is dropped, later streams start a new run which replays the plot cache."""
+    while True:
+        token, claimed = plotCache.claimRun(analysisId)
+        if token is not None:
+            break
+        time.sleep(STREAM_POLL)  # Claimed, but the owner hasn't published its run yet
+
+    run = AnalysisRun(analysisId, token)
+    if claimed:
+        threading.Thread(target=runAnalysis, args=(logFileLoc, analysisId, run),
+                         name='analysis-' + analysisId[:8], daemon=True).start()
+    return run
+
+
+def runAnalysis(logFileLoc, analysisId, run):
     try:
-        log = logFile(logFileLoc)
-        log.open()
-    except FileNotFoundError as e:
-        print('Could not find file: {}'.format(e))
-        return []
+        streamAnalysis(logFileLoc, analysisId, run.emit)
+    except Exception as e:
+        print('Unable to analyze {}. E: {}'.format(logFileLoc, e))
+    finally:
+        if not run.finished:
+            run.emit('failed', {'message': 'Unable to analyze log'})
+        plotCache.releaseRun(analysisId)
+
+
+def streamAnalysis(logFileLoc, analysisId, emit):
+    """Analyze a log, handing every result to emit(event, data) as soon as it is ready.  Events, in order:
+       progress {'phase', 'percent'} (repeated), activity, deferred (large logs, nothing else follows) or
+       plot {'target', 'item'} per plot and problem [3 messages] per problem found, then done {'timings'} or
+       failed {'message'}.  Everything is cached like the dashboard's own results, so a refresh is served from the
+       plot cache."""
+    Instrumentation.startTrace()
+    totalBytes = max(os.path.getsize(logFileLoc), 1)
+    lastPercent = {}
+
+    def progress(phase, done):
+        percent = min(100, done * 100 // totalBytes)
+        if lastPercent.get(phase) != percent:
+            lastPercent[phase] = percent
+            emit('progress', {'phase': phase, 'percent': percent})
+
+    log = None
+    try:
+        plots = plotCache.getPlots(analysisId)
+        activity = cachedActivity(analysisId)
+        if plots is None or activity is None:
+            progress('translate', 0)
+            log = logFile(logFileLoc)
+            log.progress = lambda done: progress('translate', done)
+            log.open()
+            progress('translate', totalBytes)
+
+        if activity is None:
+            activity = activityFromLog(log)
+            plotCache.put(analysisId, 'activity', json.dumps(activity))
+        emit('activity', activity)
+
+        if plots is None and totalBytes > FULL_ANALYSIS_BYTES:
+            emit('deferred', {})
+        else:
+            if plots is None:
+                plots = []
+                for plot in iterPlots(log):
+                    plots.append(plot)
+                    emit('plot', plot)
+                plotCache.putPlots(analysisId, plots)
+            else:
+                for plot in plots:
+                    emit('plot', plot)
+
+            cachedProblems = plotCache.get(analysisId, 'problems')
+            if cachedProblems is not None:
+                analysis = json.loads(cachedProblems)
+                for i in range(0, len(analysis), 3):
+                    emit('problem', analysis[i:i + 3])
+            else:
+                progress('scan', 0)
+                analysis = []
+                for problem in scanner.iter_problems(logFileLoc, progress=lambda done: progress('scan', done)):
+                    analysis.extend(problem)
+                    emit('problem', problem)
+                plotCache.put(analysisId, 'problems', json.dumps(analysis))
+                progress('scan', totalBytes)
+    except Exception as e:
+        print('Unable to analyze {}. E: {}'.format(logFileLoc, e))
+        Instrumentation.endTrace()
+        emit('failed', {'message': 'Unable to analyze log: {}'.format(e)})
+        return
+    finally:
+        if log is not None:
+            log.close()
 
-    scanner.input_file = logFileLoc
-    problem_messages = scanner.search_log()
+    emit('done', {'timings': Instrumentation.endTrace()})
 
-    return problem_messages
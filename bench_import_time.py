@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Import-time benchmark.  Imports each module in a fresh interpreter several times and reports the best wall time,
+and whether any of the heavy plotting / DataFrame libraries came along with it.
+
+    python bench_import_time.py [--runs N] [module ...]
+
+The analysis core (LogFile, ConnStateParse, SignalQualityParser, scan_log, ActivityHistogram) should report no heavy
+imports.  For a per-module breakdown of a single import use:  python -X importtime -c "import app"
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+MODULES = ['LogFile', 'ConnStateParse', 'SignalQualityParser', 'scan_log', 'ActivityHistogram', 'SharedResults', 'FleetCompare',
+           'app']
+HEAVY_LIBRARIES = ['bokeh', 'pandas', 'numpy']
+
+PROBE = '''
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "heavy": [lib for lib in {heavy!r} if lib in sys.modules]}}))
+'''
+
+
+def timeImport(module, runs):
+    """Best of runs import time for module in seconds, plus the heavy libraries it pulled in"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    best = None
+    heavy = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', PROBE.format(module=module, heavy=HEAVY_LIBRARIES)],
+                             cwd=here, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        if out.returncode != 0:
+            return None, out.stderr.strip().splitlines()[-1]
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        heavy = result['heavy']
+        if best is None or result['seconds'] < best:
+            best = result['seconds']
+    return best, heavy
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure cold import time of the analyzer modules')
+    parser.add_argument('modules', nargs='*', default=MODULES, help='modules to import (default: all)')
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per module, best time is kept')
+    args = parser.parse_args()
+
+    print('{:<22}{:>12}  {}'.format('module', 'import ms', 'heavy imports'))
+    for module in args.modules:
+        seconds, heavy = timeImport(module, args.runs)
+        if seconds is None:
+            print('{:<22}{:>12}  {}'.format(module, 'failed', heavy))
+        else:
+            print('{:<22}{:>12.1f}  {}'.format(module, seconds * 1000, ', '.join(heavy) or '-'))
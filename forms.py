@@ -1,7 +1,18 @@
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileField, FileRequired
+from wtforms import SelectField, MultipleFileField
+from wtforms.validators import DataRequired
 
 
 class logFileForm(FlaskForm):
     logFile = FileField(validators=[FileRequired()])
 
+
+class eventExportForm(FlaskForm):
+    logFile = FileField(validators=[FileRequired()])
+    exportType = SelectField(choices=[('csv', 'CSV'), ('jsonl', 'JSON Lines')], default='csv')
+
+
+class fleetLogForm(FlaskForm):
+    logFiles = MultipleFileField(validators=[DataRequired()])
+
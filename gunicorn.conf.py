@@ -0,0 +1,45 @@
+"""
+gunicorn settings for the log analyzer.  Every setting can be overridden from the environment, e.g.
+    WEB_CONCURRENCY=8 LOG_ANALYZER_BIND=0.0.0.0:80 gunicorn -c gunicorn.conf.py wsgi:app
+"""
+import gc
+import multiprocessing
+import os
+import tempfile
+
+bind = os.environ.get('LOG_ANALYZER_BIND', '0.0.0.0:5000')
+
+# Log analysis is CPU bound, so plain preforked sync workers, roughly one per core
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() + 1))
+worker_class = 'sync'
+
+# Import the app (message database, compiled patterns, bokeh via wsgi.py) in the master so workers share it copy-on-write
+preload_app = True
+
+# Large logs take a while to translate, plot and scan
+timeout = int(os.environ.get('LOG_ANALYZER_TIMEOUT', 300))
+graceful_timeout = 30
+
+# Every worker counts its own stages, /metrics sums them from this directory.  Set before the app is preloaded.
+os.environ.setdefault('LOG_ANALYZER_METRICS_DIR', os.path.join(tempfile.gettempdir(), 'log_analyzer_metrics'))
+
+# Recycle workers now and then so fragmentation from huge uploads doesn't accumulate
+max_requests = int(os.environ.get('LOG_ANALYZER_MAX_REQUESTS', 500))
+max_requests_jitter = 50
+
+
+def on_starting(server):
+    # Stage totals left by an earlier run of the server would otherwise be added to this one's
+    from Instrumentation import clearSharedMetrics
+    clearSharedMetrics()
+
+
+def when_ready(server):
+    # Sweep stale uploads from the master only, one sweeper for the whole server
+    from UploadStorage import startCleanupThread
+    startCleanupThread()
+
+
+def pre_fork(server, worker):
+    # Move everything preloaded into the permanent generation so the collector doesn't touch (and copy) those pages
+    gc.freeze()
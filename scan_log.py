@@ -5,11 +5,131 @@ messages.
 Created by Harvey Breaux for use with Cradlepoint Logs
 """
 
-import pandas as pd
 import re
 import os
 import sys
 import json
+import time
+from LogFile import LogTranslator, detectTranslator, peekLines, tokenizeLine
+from Instrumentation import stage
+
+
+class PatternIndex(object):
+    """
+    Buckets compiled database patterns by the log level and source type they are expected on, so a tokenized log
+    line only has to be tested against the patterns that could plausibly match it.  Entries without a level or type
+    (xlsx databases, blank cells) land in a wildcard bucket and are tested against every line.  Database types are
+    mapped to the sources they are logged under by TYPE_SOURCES; a line whose source no type claims only gets the
+    untyped patterns for its level.
+    """
+
+    # Different log producers spell the same level differently
+    LEVEL_ALIASES = {'ERR': 'ERROR', 'WARNING': 'WARN', 'CRITICAL': 'CRIT', 'EMERGENCY': 'EMERG'}
+
+    # Source prefixes each database Type is logged under.  Types not listed are matched on their own name.
+    TYPE_SOURCES = {'WAN': ('WAN',),                # WAN:46d497c6, WANMGR
+                    'NCM': ('NETCLOUD', 'ECM'),
+                    'IPSEC': ('IPSEC', 'CHARON', 'STARTER'),
+                    'OPENVPN': ('OPENVPN',),
+                    'OSPF': ('OSPF', 'ROUTING')}
+
+    # Shapes that make a pattern backtrack badly on long lines
+    NESTED_QUANTIFIER = re.compile(r'\((?:[^()\\]|\\.)*[*+]\??\)[*+{]')   # (a+)+, (.*x)*, ...
+    WILDCARD = re.compile(r'\.[*+]')
+    # Besides the trailing .*$ every entry is wrapped in.  One embedded wildcard is at worst quadratic, a few ms per
+    # ScanLog.MAX_LINE_LENGTH window, each further one multiplies that by the window length.
+    MAX_EMBEDDED_WILDCARDS = 1
+
+    def __init__(self, entries, skip_non_problematic=False, skip_risky=False):
+        """
+        skip_non_problematic: leave out entries whose Problematic is false.  A blank Problematic (most of the shipped
+                              database) means the entry wasn't reviewed and it is kept.
+        skip_risky: leave out patterns backtracking_risk() flags instead of only warning about them
+        """
+        self.all_patterns = []
+        self.risky_patterns = []
+        self.risky_keys = set()  # Flagged patterns that are still scanned, in smaller windows
+        self._buckets = {}
+        self._candidates = {}
+
+        for ordinal, entry in enumerate(entries):
+            if skip_non_problematic and entry.get('Problematic') is False:
+                continue
+
+            risk = self.backtracking_risk(entry['Message'])
+            if risk:
+                self.risky_patterns.append((entry['Message'], risk))
+                if skip_risky:
+                    print("Warning: skipping log database pattern %s, it may backtrack badly: %s"
+                          % (entry['Message'], risk))
+                    continue
+                print("Warning: log database pattern %s may backtrack badly: %s" % (entry['Message'], risk))
+                self.risky_keys.add(entry['Message'])
+
+            pattern = (ordinal, re.compile(entry['Message']), entry['Message'], entry['Meaning'])
+            self.all_patterns.append(pattern)
+
+            level = self.normalize_level(entry.get('Level'))
+            source_type = str(entry.get('Type') or '').strip().upper() or None
+            self._buckets.setdefault((level, source_type), []).append(pattern)
+
+    @classmethod
+    def backtracking_risk(cls, message):
+        """Return why a database pattern looks prone to catastrophic backtracking, or None if it looks fine"""
+        unescaped = re.sub(r'\\.', '', message)
+
+        if cls.NESTED_QUANTIFIER.search(unescaped):
+            return "nested quantifier, exponential backtracking when the line almost matches"
+
+        if re.match(r'^[(^]*\.[*+]', unescaped):
+            return "leading wildcard, every start position rescans the rest of the line"
+
+        wildcards = len(cls.WILDCARD.findall(unescaped))
+        if unescaped.endswith('.*$)') or unescaped.endswith('.*$'):
+            wildcards -= 1
+        if wildcards > cls.MAX_EMBEDDED_WILDCARDS:
+            return "%s embedded wildcards, polynomial backtracking on long lines" % wildcards
+
+        return None
+
+    @classmethod
+    def normalize_level(cls, level):
+        """Reduce a database or log level ('user.err', 'INFO, IPSEC CFG: 2', 'WARNING') to a canonical name"""
+        if not level:
+            return None
+        level = str(level).split(',')[0].split('.')[-1].strip().upper()
+        return cls.LEVEL_ALIASES.get(level, level) or None
+
+    @staticmethod
+    def normalize_source(source):
+        """Strip instance ids from a source ('WAN:46d497c6', 'charon[812]') so lookups are cached per subsystem"""
+        return re.split(r'[:\[]', source or '', 1)[0].upper()
+
+    @classmethod
+    def type_sources(cls, source_type):
+        """Tuple of the source prefixes a database Type is logged under, e.g. NCM -> NETCLOUD, ECM"""
+        return cls.TYPE_SOURCES.get(source_type, (source_type,))
+
+    def candidates(self, level, source):
+        """Return the patterns worth testing on a line with this level and source, in database order"""
+        key = (self.normalize_level(level), self.normalize_source(source))
+        found = self._candidates.get(key)
+        if found is None:
+            level, source = key
+
+            found = []
+            for (bucket_level, bucket_type), patterns in self._buckets.items():
+                if bucket_level not in (None, level):
+                    continue
+                if bucket_type is None or source.startswith(self.type_sources(bucket_type)):
+                    found.extend(patterns)
+            found.sort(key=lambda pattern: pattern[0])
+            self._candidates[key] = found
+
+        return found
+
+    def __len__(self):
+        return len(self.all_patterns)
 
 
 class ScanLog(object):
@@ -22,11 +142,31 @@ class ScanLog(object):
     # initialized allowed search categories
     ALLOWED_CATEGORIES = {'Connectivity+Modem', 'IPSec', 'Routing Protocols', 'NCP', 'NCM'}
 
+    # Lines longer than MAX_LINE_LENGTH (e.g. "humongous" config dumps) are matched in windows of that size, which
+    # overlap by LINE_WINDOW_OVERLAP so a message straddling a window edge is still found.  This bounds how far any
+    # one pattern can backtrack.  Patterns PatternIndex flags as risky use RISKY_LINE_LENGTH windows instead, a cubic
+    # pattern costs about 0.1s on one of those against seconds on a MAX_LINE_LENGTH one.
+    MAX_LINE_LENGTH = 4096
+    RISKY_LINE_LENGTH = 1024
+    LINE_WINDOW_OVERLAP = 512
+    # Stop a scan that runs longer than this many seconds (None to disable).  Checked after every line, and after
+    # every window of a long line.  Progress is reported every SCAN_CHECK_LINES lines.
+    SCAN_TIMEOUT = 60
+    SCAN_CHECK_LINES = 256
+
     def __init__(self, input_file, output_file, log_database='log_messages.xlsx'):
         self.input_file = input_file
         self.output_file = output_file # unused in this implementation, scanning returns a list instead of a file
         self.log_database = log_database
         self.search_categories = self.ALLOWED_CATEGORIES.copy()
+        self.skip_non_problematic = False  # ignore database entries marked "Problematic": false (blank is kept)
+        self.skip_risky_patterns = False  # leave patterns flagged by PatternIndex.backtracking_risk out of scans
+        self.max_line_length = self.MAX_LINE_LENGTH
+        self.risky_line_length = self.RISKY_LINE_LENGTH
+        self.scan_timeout = self.SCAN_TIMEOUT
+        self.use_index = True  # False tests every line against the whole database, see verify_index()
+        self._index = None
+        self._index_key = None
 
     def convert_xlsx(self):
         """
@@ -35,6 +175,9 @@ class ScanLog(object):
         This function assumes that any unique identifiers in the log messages have been replaced with ".*"
         """
 
+        # pandas is only needed for xlsx databases, so it is imported here instead of at module load
+        import pandas as pd
+
         # assemble path to xlsx
         dirname = os.path.dirname(__file__)
         xlsx = os.path.join(dirname, self.log_database)
@@ -67,6 +210,17 @@ class ScanLog(object):
         For each "message" line a regex group trailer and header get applied.
         This function assumes that any unique identifiers in the log messages have been replaced with ".*"
         """
+        search_dictionary = {}
+        for entry in self.load_json_entries():
+            search_dictionary[entry["Message"]] = entry["Meaning"]
+
+        return search_dictionary
+
+    def load_json_entries(self):
+        """
+        Load the json database keeping each message's Level, Type and Problematic metadata alongside the Message
+        and Meaning.  Duplicate messages collapse the same way they do in convert_json().
+        """
         # assemble path to json
         dirname = os.path.dirname(__file__)
         json_file = os.path.join(dirname, self.log_database)
@@ -74,44 +228,211 @@ class ScanLog(object):
         with open(json_file, 'r') as j:
             json_dictionary = json.load(j)
 
-        # make our search dictionary
-        search_dictionary = {}
+        entries = {}
 
-        # Loop through our search categories to load any messages in them into our search_dictionary
+        # Loop through our search categories to load any messages in them
         for category in self.search_categories:
             category_messages = json_dictionary[category]
             for messages in category_messages:
-                search_dictionary[messages.get("Message")] = messages.get("Meaning")
+                entry = entries.setdefault(messages.get("Message"), {})
+                entry.update(messages)
+                entry["Category"] = category
 
-        return search_dictionary
+        return list(entries.values())
+
+    def build_index(self):
+        """Load the log database and bucket its patterns into a PatternIndex"""
+        if self.log_database.endswith('.json'):
+            entries = self.load_json_entries()
+        else:
+            # The xlsx database only carries message + meaning, so every pattern is a wildcard
+            entries = [{"Message": key, "Meaning": value} for key, value in self._convert_db().items()]
+
+        return PatternIndex(entries, skip_non_problematic=self.skip_non_problematic,
+                            skip_risky=self.skip_risky_patterns)
 
-    def search_log(self):
+    def get_index(self):
         """
-        search_log a log file for search terms and then write matches + their meanings to an output file
-        dictionary: dictionary from convert_xlsx() or convert_json()
+        Return the PatternIndex for the current database, categories and flags.  It is only rebuilt when one of those
+        changes, so calling this once up front (e.g. before a server forks its workers) preloads the compiled patterns.
         """
-        # create search dictionary from our database
-        dictionary = self._convert_db()
+        key = (self.log_database, frozenset(self.search_categories), self.skip_non_problematic,
+               self.skip_risky_patterns)
+        if self._index is None or self._index_key != key:
+            self._index = self.build_index()
+            self._index_key = key
+        return self._index
 
+    def search_log(self, input_file=None, time_window=None):
+        """
+        search_log a log file for search terms and then write matches + their meanings to an output file
+        Lines that can be translated and tokenized are only tested against the patterns for their level and source.
+        Anything else (headers, unknown formats) is tested against the whole database.
+        input_file: log to scan, defaults to self.input_file
+        time_window: optional (start, end) datetimes, lines timestamped outside of it are skipped
+        """
         problem_messages = []
+        for problem in self.iter_problems(input_file, time_window):
+            problem_messages.extend(problem)
+        return problem_messages
+
+    def iter_problems(self, input_file=None, time_window=None, progress=None):
+        """
+        Same scan as search_log, but yields the three messages of each problem as soon as it is found.
+        progress: optional callable, called with the number of characters read every SCAN_CHECK_LINES lines
+        """
+        index = self.get_index()
+
+        deadline = time.perf_counter() + self.scan_timeout if self.scan_timeout else None
+        counts = [0, 0]
 
         # open input and output files
-        with open(self.input_file, 'r', encoding='UTF-8') as input_file:
+        with open(input_file or self.input_file, 'r', encoding='UTF-8') as input_file, stage('scan') as st:
 
             # search every line for a match
-            for i, line in enumerate(input_file, 1):
-                for key in dictionary.keys():
-                    # search line for a match
-                    match = re.search(key, line)
-
-                    # if there's a match, write the line, match, and the meaning to our output file
-                    if match:
-                        # 1/2/20 - removing print of whole log message because some messages are humongous
-                        problem_messages.append("Problem found on line %s: " % i)
-                        problem_messages.append(" %s" % key)
-                        problem_messages.append("Common meaning of error: %s" % dictionary[key] + '\n')
+            timed_out = False
+            for i, line, patterns in self._candidate_lines(input_file, index, counts, time_window):
+                for (ordinal, regex, key, meaning), segments in self._pattern_tests(line, patterns, index):
+                    # Long lines check the time limit after every window, so one pattern can't stall the scan
+                    check_windows = deadline is not None and len(segments) > 1
+                    for segment in segments:
+                        # search line for a match
+                        match = regex.search(segment)
 
-        return problem_messages
+                        # if there's a match, write the line, match, and the meaning to our output file
+                        if match:
+                            # 1/2/20 - removing print of whole log message because some messages are humongous
+                            yield ["Problem found on line %s: " % i,
+                                   " %s" % key,
+                                   "Common meaning of error: %s" % meaning + '\n']
+                            break
+                        if check_windows and time.perf_counter() > deadline:
+                            timed_out = True
+                            break
+                    if timed_out:
+                        break
+
+                if progress is not None and i % self.SCAN_CHECK_LINES == 0:
+                    progress(counts[1])
+                if timed_out or deadline is not None and time.perf_counter() > deadline:
+                    yield ["Scan stopped at line %s: " % i,
+                           " time limit of %s seconds reached" % self.scan_timeout,
+                           "Remaining lines were not searched for problem messages" + '\n']
+                    break
+
+            st.lines, st.bytes = counts
+
+    def _candidate_lines(self, input_file, index, counts, time_window=None):
+        """
+        Yield (line number, line, patterns to test) for every line of an open log.  Patterns are narrowed by
+        level/source where the line can be tokenized.  counts is updated in place with the number of lines and
+        characters read.
+        With a time_window ((start, end) datetimes) only lines timestamped inside it are yielded.  Lines without a
+        timestamp (continuations, lines the translator holds back) go wherever the line before them went, anything
+        before the first timestamp or past the end of the log content is skipped.
+        """
+        head, lines = peekLines(input_file)
+        translator = detectTranslator(head)
+        in_window = True
+        if time_window is not None:
+            if translator is None:
+                # Nothing can be placed in the window without a translator
+                return
+            time_window = [when.strftime(LogTranslator.OUTPUT_DATE_FORMAT) for when in time_window]
+            in_window = False
+
+        for i, line in enumerate(lines, 1):
+            counts[0] = i
+            counts[1] += len(line)
+            patterns = index.all_patterns
+            if translator is not None:
+                tokens = tokenizeLine(translator.translateLine(line) or '')
+                if tokens is not None:
+                    if time_window is not None:
+                        in_window = time_window[0] <= tokens['timestamp'] < time_window[1]
+                    if self.use_index:
+                        patterns = index.candidates(tokens['level'], tokens['source'])
+                if translator.abort:
+                    if time_window is not None:
+                        # The rest (e.g. NCM export sections) carries no timestamps to place in the window
+                        break
+                    # Past the log content, fall back to the full database
+                    translator = None
+            if not in_window:
+                continue
+
+            yield i, line, patterns
+
+    def _windows(self, line, max_length):
+        """The line itself, or overlapping windows of it when longer than max_length"""
+        if not max_length or len(line) <= max_length:
+            return (line,)
+        step = max(max_length - self.LINE_WINDOW_OVERLAP, 1)
+        return [line[start:start + max_length] for start in range(0, len(line) - self.LINE_WINDOW_OVERLAP, step)]
+
+    def _pattern_tests(self, line, patterns, index):
+        """Yield (pattern, segments to search) for each pattern to test on a line, smaller windows for risky ones"""
+        segments = self._windows(line, self.max_line_length)
+        risky_segments = None
+        for pattern in patterns:
+            if pattern[2] in index.risky_keys:
+                if risky_segments is None:
+                    risky_segments = self._windows(line, self.risky_line_length)
+                yield pattern, risky_segments
+            else:
+                yield pattern, segments
+
+    def profile_patterns(self, input_files):
+        """
+        Scan a corpus of logs timing every pattern test.  Returns a list of
+        (pattern, tests, total seconds, hits) sorted with the most expensive pattern first.
+        """
+        index = self.get_index()
+        stats = dict((key, [0, 0.0, 0]) for ordinal, regex, key, meaning in index.all_patterns)
+        timer = time.perf_counter
+
+        for input_file in input_files:
+            with open(input_file, 'r', encoding='UTF-8') as log:
+                for i, line, patterns in self._candidate_lines(log, index, [0, 0]):
+                    for (ordinal, regex, key, meaning), segments in self._pattern_tests(line, patterns, index):
+                        start = timer()
+                        match = any(regex.search(segment) for segment in segments)
+                        elapsed = timer() - start
+
+                        pattern_stats = stats[key]
+                        pattern_stats[0] += 1
+                        pattern_stats[1] += elapsed
+                        if match:
+                            pattern_stats[2] += 1
+
+        return sorted(((key,) + tuple(value) for key, value in stats.items()), key=lambda row: row[2], reverse=True)
+
+    def verify_index(self, input_files):
+        """
+        Scan each log with and without the PatternIndex buckets.  Returns a list of (input file, problems only the
+        unbucketed scan found, problems only the bucketed scan found); both empty when bucketing lost nothing.
+        """
+        use_index, scan_timeout = self.use_index, self.scan_timeout
+        self.scan_timeout = None
+        differences = []
+        try:
+            for input_file in input_files:
+                found = []
+                for self.use_index in (False, True):
+                    found.append(set(tuple(problem[:2]) for problem in self.iter_problems(input_file)))
+                differences.append((input_file, sorted(found[0] - found[1]), sorted(found[1] - found[0])))
+        finally:
+            self.use_index, self.scan_timeout = use_index, scan_timeout
+        return differences
+
+    def profile_report(self, input_files):
+        """profile_patterns() formatted as a table, flagging any pattern the database load found risky"""
+        risky = dict(self.get_index().risky_patterns)
+        rows = ["%10s %8s %6s  %s" % ("total ms", "tests", "hits", "pattern")]
+        for key, tests, seconds, hits in self.profile_patterns(input_files):
+            flag = "  <-- %s" % risky[key] if key in risky else ""
+            rows.append("%10.2f %8d %6d  %s%s" % (seconds * 1000, tests, hits, key, flag))
+        return '\n'.join(rows)
 
     def _convert_db(self):
         """Check log db type and return the correctly dictionary"""
@@ -138,4 +459,19 @@ class ScanLog(object):
 
 
 if __name__ == "__main__":
-    ScanLog(sys.argv[1], sys.argv[2], 'log_messages.json').search_log()
+    if len(sys.argv) > 2 and sys.argv[1] == '--profile':
+        # python scan_log.py --profile log1 [log2 ...]  -> per-pattern cost across the given logs
+        print(ScanLog(None, None, 'log_messages.json').profile_report(sys.argv[2:]))
+    elif len(sys.argv) > 2 and sys.argv[1] == '--verify':
+        # python scan_log.py --verify log1 [log2 ...]  -> problems the level/source buckets miss, exits 1 if any
+        failed = False
+        for input_file, missed, extra in ScanLog(None, None, 'log_messages.json').verify_index(sys.argv[2:]):
+            failed = failed or bool(missed or extra)
+            print("%s: %s missed, %s extra" % (input_file, len(missed), len(extra)))
+            for line, key in missed:
+                print("  missed %s%s" % (line, key))
+            for line, key in extra:
+                print("  extra %s%s" % (line, key))
+        sys.exit(1 if failed else 0)
+    else:
+        ScanLog(sys.argv[1], sys.argv[2], 'log_messages.json').search_log()
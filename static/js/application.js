@@ -1,5 +1,90 @@
 $(document).ready(function(){
+    var stream = $('#analysis-stream');
+    if (stream.length) {
+        streamAnalysis(stream);
+    }
+});
 
 
+// Follow the server-sent events of an analysis (see streamAnalysis in app.py), showing the progress and every
+// result as soon as it arrives instead of waiting for the whole analysis
+function streamAnalysis(stream) {
+    var source = new EventSource(stream.data('url'));
+    var phases = {'translate': 'Reading log', 'scan': 'Searching for problem messages'};
+    var problemClasses = ['thick', 'error-message', ''];
 
-});
\ No newline at end of file
+    function embedPlot(container, plot) {
+        container.append($('<div>').attr('id', plot.target));
+        Bokeh.embed.embed_item(JSON.parse(plot.item), plot.target);
+    }
+
+    function section(container, title) {
+        if (!container.children().length) {
+            container.append($('<h4>').text(title));
+        }
+        return container;
+    }
+
+    source.addEventListener('progress', function(e) {
+        var data = JSON.parse(e.data);
+        $('#analysis-progress').val(data.percent);
+        $('#analysis-phase').text((phases[data.phase] || data.phase) + ' ' + data.percent + '%');
+    });
+
+    source.addEventListener('activity', function(e) {
+        var activity = JSON.parse(e.data);
+        if (!activity.plots.length) {
+            return;
+        }
+        var plots = section($('#stream-activity'), 'Log Activity');
+        activity.plots.forEach(function(plot) { embedPlot(plots, plot); });
+
+        var windows = $('#stream-windows').append($('<p>').text('Busiest windows:'));
+        activity.hotWindows.forEach(function(hot) {
+            var url = stream.data('window-url') + '?' + $.param({start: hot[0], end: hot[1]});
+            windows.append($('<p class="error-message">').append(
+                $('<a>').attr('href', url).text(hot[0] + ' - ' + hot[1]), ' (' + hot[2] + ' lines)'));
+        });
+    });
+
+    source.addEventListener('deferred', function(e) {
+        $('#stream-windows').prepend($('<p class="thick">').append(
+            'This log is large, pick a window to analyze or ',
+            $('<a>').attr('href', stream.data('window-url')).text('analyze the whole log'), '.'));
+    });
+
+    source.addEventListener('plot', function(e) {
+        embedPlot(section($('#stream-plots'), 'Connection State Graphs'), JSON.parse(e.data));
+    });
+
+    source.addEventListener('problem', function(e) {
+        var problems = section($('#stream-problems'), 'Log Message Analysis');
+        JSON.parse(e.data).forEach(function(msg, i) {
+            problems.append($('<p>').addClass(problemClasses[i]).text(msg));
+        });
+    });
+
+    source.addEventListener('done', function(e) {
+        source.close();
+        $('#analysis-progress').val(100);
+        $('#analysis-phase').text('Analysis complete');
+
+        var timings = JSON.parse(e.data).timings;
+        if (timings.length) {
+            var table = $('<table class="timing-footer">').append(
+                '<tr><th>Stage</th><th>Seconds</th><th>Lines</th><th>Bytes</th></tr>');
+            timings.forEach(function(t) {
+                var name = t.stage;
+                $.each(t.labels, function(key, value) { name += ' ' + key + '=' + value; });
+                table.append($('<tr>').append($('<td>').text(name), $('<td>').text(t.seconds.toFixed(3)),
+                                              $('<td>').text(t.lines || ''), $('<td>').text(t.bytes || '')));
+            });
+            $('#stream-timings').append(table);
+        }
+    });
+
+    source.addEventListener('failed', function(e) {
+        source.close();
+        $('#analysis-phase').text(JSON.parse(e.data).message);
+    });
+}
@@ -0,0 +1,12 @@
+"""
+Production WSGI entry point.  Run with:
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Importing app loads the problem message database and compiles its patterns, and with preload_app set that happens
+once in the gunicorn master, before the workers are forked, so every worker shares the same copy-on-write pages.
+The app itself defers importing bokeh until a plot is drawn; a server is going to draw plots, so bokeh is imported
+here up front to get it into the shared pages too.
+"""
+import bokeh.embed
+import bokeh.plotting
+from app import app